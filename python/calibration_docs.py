@@ -0,0 +1,280 @@
+# Cache of the calibration documents read by ctd_review.py and underway_review.py.
+# XMLCON and calibration .xml files are kept as parsed element trees, .pdf calibration sheets as extracted text.
+# Two tiers:
+#     memory - the most recently used documents of this run (bounded LRU), keyed by path or URL
+#     disk   - SQLite file keyed by path, size and mtime (local files) or URL and ETag (http files),
+#              so a re-run does not extract the text of the PDF sheets again
+# Hit and miss counters are kept for the report. The disk tier is in the user's cache directory
+# (~/.cache/nes-lter-ims-utils) unless the reviews are given another file (--doc-cache).
+# Documents are read by URL scheme: local paths (and file: URLs) straight from disk, http(s) URLs with one
+# keep-alive session per process, streamed in chunks. prefetch_documents downloads several documents at once.
+# The disk tier can be filled before a review, with the text of every PDF in a calibration tree extracted
+# in parallel:
+#     python calibration_docs.py ctd/doc --workers 8
+
+import argparse
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import unicodedata
+import sqlite3
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+import xml.etree.ElementTree as ET
+import fitz  #PyMuPDF
+import requests
+
+DEFAULT_MAX_ITEMS = 256
+DOCUMENT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'nes-lter-ims-utils', 'calibration_doc_cache.sqlite')
+HTTP_TIMEOUT = (10, 120)      # connect, read seconds
+HTTP_POOL_SIZE = 8            # connections kept open per host, also the number of prefetch threads
+DOWNLOAD_CHUNK = 1024 * 1024
+CACHE_LOCK_TIMEOUT = 60       # seconds to wait for another review process writing to the disk tier
+
+http_session = None
+
+# characters in PDF text that are written differently in the XMLCON files
+PDF_CHARACTERS = str.maketrans({'\u2212': '-', '\u2013': '-', '\u00a0': ' '})
+
+# memory: key -> document (OrderedDict, most recently used last), connection: SQLite connection or None
+DocumentCache = namedtuple('DocumentCache', ['memory', 'max_items', 'connection', 'counters'])
+
+def open_document_cache(cache_file=None, max_items=DEFAULT_MAX_ITEMS):
+    connection = None
+    if cache_file:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        connection = sqlite3.connect(cache_file, timeout=CACHE_LOCK_TIMEOUT)
+        connection.execute("""CREATE TABLE IF NOT EXISTS documents (
+            path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, etag TEXT, kind TEXT, content BLOB, image_only INTEGER)""")
+    return DocumentCache(OrderedDict(), max_items, connection, {'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+
+def close_document_cache(cache):
+    if cache.connection:
+        cache.connection.commit()
+        cache.connection.close()
+
+def url_scheme(file):
+    scheme = urlparse(file).scheme.lower()
+    # a windows drive letter (C:\) is parsed as a one letter scheme
+    return scheme if len(scheme) > 1 else ''
+
+def is_url(file):
+    return url_scheme(file) in ('http', 'https')
+
+def local_path(file):
+    if url_scheme(file) == 'file':
+        return url2pathname(urlparse(file).path)
+    return file
+
+def get_session():
+    # one keep-alive session per process, so calibration files on the same server reuse the connection
+    global http_session
+    if http_session is None:
+        http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE, max_retries=2)
+        http_session.mount('http://', adapter)
+        http_session.mount('https://', adapter)
+    return http_session
+
+def download(url):
+    # stream the response in chunks instead of holding the connection until the whole body is buffered by requests
+    with get_session().get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+        response.raise_for_status()
+        content = bytearray()
+        for chunk in response.iter_content(DOWNLOAD_CHUNK):
+            content += chunk
+    return bytes(content)
+
+def document_version(file):
+    # (size, mtime_ns, etag) that identify the content of the file, or None if it cannot be identified
+    # http servers without an ETag header are identified by Last-Modified
+    if is_url(file):
+        try:
+            headers = get_session().head(file, allow_redirects=True, timeout=HTTP_TIMEOUT).headers
+        except requests.RequestException:
+            return None
+        etag = headers.get('ETag') or headers.get('Last-Modified')
+        return (None, None, etag) if etag else None
+    try:
+        stat = os.stat(local_path(file))
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns, None)
+
+def normalize_pdf_text(text):
+    # compatibility forms (i.e. ligatures, superscripts), unicode minus signs and dashes, no trailing spaces
+    text = unicodedata.normalize('NFKC', text).translate(PDF_CHARACTERS)
+    return '\n'.join(line.rstrip() for line in text.splitlines())
+
+def pdf_text(pdf_document):
+    text = ""
+    for page_num in range(pdf_document.page_count):
+        page = pdf_document[page_num]
+        text += page.get_text()
+    return normalize_pdf_text(text)
+
+def read_document(file):
+    # Return (kind, content): ('xml', xml bytes), ('pdf', text, "" if the PDF cannot be read) or (None, None)
+    if is_url(file):
+        is_pdf = urlparse(file).path.lower().endswith(".pdf")
+        try:
+            content = download(file)
+        except requests.RequestException as e:
+            if not is_pdf:
+                raise
+            print(f"Error downloading {file}: {e}")
+            return 'pdf', ""
+        if is_pdf:
+            with fitz.open("pdf", content) as pdf_document:
+                return 'pdf', pdf_text(pdf_document)
+        return 'xml', content
+    path = local_path(file)
+    if path.lower().endswith(".xml") or path.lower().endswith(".xmlcon"):
+        with open(path, "rb") as f:
+            return 'xml', f.read()
+    elif path.lower().endswith(".pdf"):
+        try:
+            with fitz.open(path) as pdf_document:
+                return 'pdf', pdf_text(pdf_document)
+        except Exception as e:
+            print(f"Error reading {path}: {e}")
+            return 'pdf', ""
+    return None, None
+
+def to_document(kind, content):
+    if kind == 'xml':
+        return ET.fromstring(content)
+    return content
+
+def cached_document(cache, file, version):
+    row = cache.connection.execute("SELECT size, mtime_ns, etag, kind, content FROM documents WHERE path = ?",
+                                   (file,)).fetchone()
+    if row is None or tuple(row[:3]) != version:
+        return None
+    return row[3], row[4]
+
+def store_document(cache, file, version, kind, content, commit=True):
+    # image_only: a PDF without text, i.e. a scanned calibration sheet
+    image_only = int(kind == 'pdf' and not content.strip())
+    cache.connection.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (file, *version, kind, content, image_only))
+    if commit:
+        cache.connection.commit()
+
+def remember(cache, key, document):
+    cache.memory[key] = document
+    cache.memory.move_to_end(key)
+    while len(cache.memory) > cache.max_items:
+        cache.memory.popitem(last=False)
+
+def load_document(cache, file):
+    # Return the parsed element tree (.xml, .xmlcon) or the text (.pdf, "" if there is no text) of a document
+    key = file if is_url(file) else os.path.abspath(local_path(file))
+    if key in cache.memory:
+        cache.counters['memory_hits'] += 1
+        cache.memory.move_to_end(key)
+        return cache.memory[key]
+
+    version = document_version(file) if cache.connection else None
+    stored = cached_document(cache, key, version) if version else None
+    if stored:
+        cache.counters['disk_hits'] += 1
+        kind, content = stored
+    else:
+        cache.counters['misses'] += 1
+        kind, content = read_document(file)
+    document = to_document(kind, content)
+    if version and kind and not stored:
+        store_document(cache, key, version, kind, content)
+    remember(cache, key, document)
+    return document
+
+def try_read_document(file):
+    try:
+        return read_document(file)
+    except Exception:
+        return None
+
+def prefetch_documents(cache, files, workers=HTTP_POOL_SIZE):
+    # Download the http(s) documents that are not cached yet in parallel threads, load_document then finds
+    # them in the memory tier. Local files are read when they are used
+    urls = list(dict.fromkeys(file for file in files if is_url(file) and file not in cache.memory))
+    if not urls:
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        versions = list(executor.map(document_version, urls)) if cache.connection else [None] * len(urls)
+        stored = [cached_document(cache, url, version) if version else None for url, version in zip(urls, versions)]
+        missing = [url for url, document in zip(urls, stored) if document is None]
+        downloaded = dict(zip(missing, executor.map(try_read_document, missing)))
+    for url, version, document in zip(urls, versions, stored):
+        if document:
+            cache.counters['disk_hits'] += 1
+            kind, content = document
+        else:
+            if downloaded[url] is None:
+                continue     # load_document reports the error when the document is used
+            cache.counters['misses'] += 1
+            kind, content = downloaded[url]
+            if version and kind:
+                store_document(cache, url, version, kind, content)
+        remember(cache, url, to_document(kind, content))
+
+def cache_report(cache):
+    counters = cache.counters
+    return (f"Document cache: {counters['memory_hits']} memory hits, {counters['disk_hits']} disk hits, "
+            f"{counters['misses']} documents read")
+
+def find_pdf_files(url):
+    pdf_files = []
+    for root, _, files in os.walk(url):
+        pdf_files.extend(os.path.join(root, file) for file in files if file.lower().endswith('.pdf'))
+    return sorted(pdf_files)
+
+def extract_pdf(file):
+    # Return (path, version, text) of a local PDF file, text is None if the file cannot be read
+    version = document_version(file)
+    try:
+        with fitz.open(file) as pdf_document:
+            return os.path.abspath(file), version, pdf_text(pdf_document)
+    except Exception as e:
+        print(f"Error reading {file}: {e}")
+        return os.path.abspath(file), version, None
+
+def warm_documents(urls, cache_file, workers=1):
+    # Extract the text of every PDF in the calibration trees that is not in the disk tier yet.
+    # Returns the image only PDF files
+    cache = open_document_cache(cache_file)
+    files = [file for url in urls for file in find_pdf_files(url)]
+    changed_files = [file for file in files
+                     if cached_document(cache, os.path.abspath(file), document_version(file)) is None]
+    print(f"Extracting text from {len(changed_files)} of {len(files)} PDF files")
+
+    if workers > 1 and len(changed_files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            extracted = list(executor.map(extract_pdf, changed_files, chunksize=4))
+    else:
+        extracted = [extract_pdf(file) for file in changed_files]
+    for path, version, text in extracted:
+        if version and text is not None:
+            store_document(cache, path, version, 'pdf', text, commit=False)
+
+    paths = set(os.path.abspath(file) for file in files)
+    image_only = [row[0] for row in cache.connection.execute(
+        "SELECT path FROM documents WHERE image_only = 1 ORDER BY path") if row[0] in paths]
+    close_document_cache(cache)
+    for file in image_only:
+        print(f"PDF file is NOT in machine readable format: {file}")
+    return image_only
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract the text of the PDF calibration sheets before a ctd_review or underway_review run.')
+    parser.add_argument('path', type=str, nargs='+', help='Path to calibration file directory (searched recursively)')
+    parser.add_argument('--cache', type=str, default=DOCUMENT_CACHE_FILE, help=f'SQLite file read by the reviews (--doc-cache, default: {DOCUMENT_CACHE_FILE})')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes extracting PDF text (default: number of cpus)')
+
+    args = parser.parse_args()
+
+    warm_documents(args.path, args.cache, args.workers)
+
+if __name__ == '__main__':
+    main()
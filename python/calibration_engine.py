@@ -0,0 +1,414 @@
+# Calibration checks shared by ctd_review.py and underway_review.py.
+# An XMLCON is checked sensor by sensor against the calibration .xml file (values, dates, coefficients of each
+# equation) or the text of the .pdf calibration sheet of the sensor's serial number.
+# The rules that differ per instrument family are in InstrumentFamily: the name of the results file, the
+# directory of the cruise (CRUISE/ctd/raw, CRUISE/tsg/raw), the file name prefix of a sensor's calibration
+# files (the underway temperature and conductivity calibrations are SBE3_T4321..., SBE4_C4321...), the XMLCON
+# files left out of the review and whether a .pdf sheet without a Date (scanned images) is only noted.
+# State shared by all reviews in a process, so reviewing the CTD and the underway XMLCONs of a cruise back to back
+# reads each calibration document once:
+#     document_cache   - parsed documents (see calibration_docs.py), set_document_cache for the on-disk tier
+#     calib_indexes    - calibration directory -> CalibrationIndex
+#     checked_sensors  - the report lines and failures of a sensor checked against a calibration file, keyed by
+#                        the sensor's XMLCON elements, so a sensor in several configurations is checked once;
+#                        the last CHECKED_SENSORS_MAX sensors are kept
+# The report of each review (buffer, failed instrument serial numbers) is in a Review.
+
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from io import StringIO
+from urllib.parse import urlparse, urlunparse
+import os
+import re
+from glob import glob
+import xml.etree.ElementTree as ET
+from calibration_docs import open_document_cache, load_document, prefetch_documents
+from calibration_index import build_calibration_index, find_calib_file_with_serial_number
+from calibration_trees import find_sensor, find_tag, find_tags
+from pdf_tokens import has_number, has_date
+from xmlcon_groups import group_xmlcon_files, distinct_groups, diff_xmlcon_files, xmlcon_digests
+
+# name: results file CRUISE_{name}_calibration_results.txt, directory: cruise directory of the raw and doc
+# directories, sensor_prefixes: sensor element tag -> calibration file name prefix of the serial number,
+# excluded_xmlcon: XMLCON files with any of these in the path are not reviewed, pdf_date_optional: a .pdf
+# calibration sheet without a Date is noted instead of failing the date check
+InstrumentFamily = namedtuple('InstrumentFamily', ['name', 'directory', 'sensor_prefixes', 'excluded_xmlcon', 'pdf_date_optional'])
+CTD = InstrumentFamily('ctd', 'ctd', {}, ('L011B11', '_original.'), False)     #en668, en720
+UNDERWAY = InstrumentFamily('underway', 'tsg', {'TemperatureSensor': 'T', 'ConductivitySensor': 'C'}, (), True)
+
+CHECKED_SENSORS_MAX = 1000
+
+Review = namedtuple('Review', ['buffer', 'failed_instruments'])
+
+# memory only until set_document_cache
+document_cache = open_document_cache()
+calib_indexes = {}
+checked_sensors = OrderedDict()
+
+def new_review():
+    return Review(StringIO(), [])
+
+def set_document_cache(cache):
+    global document_cache
+    document_cache = cache
+
+def get_calibration_index(calib_file_path):
+    # list the calibration directory once, sensors are looked up by serial number in the index
+    if calib_file_path not in calib_indexes:
+        calib_indexes[calib_file_path] = build_calibration_index(calib_file_path)
+    return calib_indexes[calib_file_path]
+
+def get_cruise_name(xmlcon_file_path):
+    match = re.search(r'ship-provided_data_(.*?)[\\/]', xmlcon_file_path)
+    if match:
+        return match.group(1)
+    return None
+
+def get_default_cruise_name(xmlcon_file_path, family=CTD):
+    # the directory above ctd (CRUISE/ctd/raw) or tsg, else the last directory of the path
+    parts = [part for part in re.split(r'[\\/]', os.path.normpath(xmlcon_file_path)) if part]
+    lower_parts = [part.lower() for part in parts]
+    if family.directory in lower_parts[1:]:
+        return parts[len(parts) - 1 - lower_parts[::-1].index(family.directory) - 1]
+    return os.path.splitext(parts[-1])[0] if parts else family.name
+
+def write_results(review, results_file):
+    # summary first, then the report
+    with open(results_file, "w") as file:
+        file.write(f"Summary Report\n")
+        file.write(f"List of Failed Instrument Serial Numbers: \n")
+        file.write(f"{review.failed_instruments}\n")
+        file.write(f"\n")
+        file.write(review.buffer.getvalue())
+
+def find_xmlcon_files(url, family=CTD):
+    matching_files = []
+    for file in glob(os.path.join(url, '*.XMLCON')):
+        if not any(excluded in file for excluded in family.excluded_xmlcon):
+            matching_files.append(file)
+    return matching_files
+
+def get_data(review, file):
+    # Read the xmlcon, calibration xml or pdf text through the document cache, so each document is parsed once
+    data = load_document(document_cache, file)
+    if isinstance(data, str) and data == "":
+        review.buffer.write(f"PDF file is NOT in machine readable format: {file}\n")
+    return data
+
+def get_doc_dir(xmlcon_file_path):
+    # get the ctd/doc dir name for this cruise
+    url_parts = list(urlparse(xmlcon_file_path))
+
+    # Remove the last component (file name) from the path and append /doc
+    url_parts_path = '/'.join(url_parts[2].split('/')[:-1]) + '/doc/'
+
+    url_parts[2] = url_parts_path
+    return urlunparse(url_parts)
+
+def record_failure(review, serial_number):
+    if serial_number not in review.failed_instruments:
+        review.failed_instruments.append(serial_number)
+
+def check_coefficients(review, xmlcon_root, sensor_element, sensor_root, serial_number):
+    for element in sensor_element:
+        review.buffer.write(f"{element.tag}: {element.text}\n")
+        process_each_element(review, xmlcon_root, element, sensor_root, serial_number)
+
+def process_each_element(review, xmlcon_root, element, sensor_root, serial_number):
+    calib_element = find_sensor(xmlcon_root, element.tag, serial_number)
+    print(f"serial number: {serial_number}")
+    check_calib_elements(review, calib_element, sensor_root, serial_number)
+
+def check_calib_elements(review, calib_element, sensor_root, serial_number):
+    coef_index = 0  # coefficient tag equation index
+    for calib in calib_element:
+        if calib.tag == 'Coefficients' or calib.tag == 'CalibrationCoefficients':
+            review.buffer.write(f"Checking {calib.tag}: {calib.attrib}\n")
+            check_calibration_tags(review, calib, sensor_root, coef_index, serial_number)
+            coef_index += 1
+
+def check_calibration_tags(review, calib, sensor_root, coef_index, serial_number):
+    tag_occurrences = find_tags(sensor_root, calib.tag)
+    if tag_occurrences:
+        tag = tag_occurrences[coef_index] if len(tag_occurrences) > coef_index else None
+        compare_tags(review, calib, tag, serial_number)
+        check_coefficient_details(review, calib, sensor_root, coef_index, serial_number)
+
+def compare_tags(review, calib, tag, serial_number):
+    if calib.attrib == tag.attrib:
+        review.buffer.write(f"Calibration Value check passed\n")
+    else:
+        review.buffer.write(f"Check FAILED: calibration {calib.tag} and {calib.attrib} do not match values in calib file: {tag.attrib}\n")
+        record_failure(review, serial_number)
+
+def check_coefficient_details(review, calib, sensor_root, coef_index, serial_number):
+    coef_elements = calib.findall('.//')
+    for coef in coef_elements:
+        review.buffer.write(f"Checking {coef.tag}: {coef.text}\n")
+        ctags = find_tags(sensor_root, coef.tag)
+        process_coefficient_matches(review, ctags, coef, coef_index, serial_number)
+
+def process_coefficient_matches(review, ctags, coef, coef_index, serial_number):
+    ctag = ctags[coef_index] if len(ctags) > 1 else ctags[0] if ctags else None
+    print(f"len(ctags) {len(ctags)}")
+    print(f"ctag {ctag}")
+    print(f"coef_index {coef_index}")
+    if float(coef.text) == float(ctag.text):
+        review.buffer.write(f"Calibration Value check passed\n")
+    else:
+        review.buffer.write(f"Check FAILED: calibration {coef.tag} and {coef.text} do not match values in calib file: {ctag.text}\n")
+        record_failure(review, serial_number)
+
+def check_date(date):
+    date_formats = [
+        "%d-%b-%y",
+        "%d-%b-%Y",
+        "%m/%d/%Y",
+        "%Y%m%d",
+        "%B %d, %Y",
+        "%Y-%b-%d",
+        "%d-%B-%Y",
+        "%Y-%m-%d",
+        "%d %b %Y"
+    ]
+    for date_format in date_formats:
+        try:
+            parsed_date = datetime.strptime(date, date_format)
+            # Successfully parsed, format and return the date
+            month = str(int(parsed_date.strftime("%m")))  # Remove leading zero
+            day = str(int(parsed_date.strftime("%d")))    # Remove leading zero
+            year = parsed_date.strftime("%Y")            # Keep four-digit year
+            return f"{month}/{day}/{year}"               # Return formatted date
+        except:
+            continue  # Try the next format if the current one fails
+
+    # If all formats fail, return an empty string
+    return ''
+
+def check_calibrations(review, xmlcon_root, sensor_element, sensor_root, serial_number):
+    # For each element in the sensor element (TemperatureSensor, ConductivitySensor, PressureSensor, etc)
+    buffer = review.buffer
+    for element in sensor_element:
+        buffer.write(f"{element.tag}: {element.text}\n")
+        calib_element = find_sensor(xmlcon_root, element.tag, serial_number)
+
+        # for each calibration tag in sensor
+        for calib in calib_element:
+            # Process Coefficients separately below
+            if calib.tag not in ['SerialNumber', 'CalibrationDate', 'Coefficients', 'CalibrationCoefficients']:
+                tag = find_tag(sensor_root, calib.tag)
+                # check if calibration tag and text in xmlcon file in calibration file for the serial number of sensor
+                if tag is not None:
+                    tag_date = find_tag(sensor_root, 'CalibrationDate')
+                    calib_date = calib_element.find('CalibrationDate')
+                    if float(tag.text) != float(calib.text):
+                        buffer.write(f"Checking {calib.tag}: {calib.text}\n")
+                        buffer.write(f"Check FAILED: calibration {calib.tag} and {calib.text} do not match values in calib file: {tag.text}\n")
+                        record_failure(review, serial_number)
+                    elif tag_date.text != calib_date.text:
+                        buffer.write(f"Checking {calib.tag}: {calib.text}\n")
+                        tag_date_str = check_date(tag_date.text)
+                        calib_date_str = check_date(calib_date.text)
+                        if (tag_date_str != calib_date_str) or (tag_date_str == '') or (calib_date_str == ''):
+                            buffer.write(f"Check FAILED: calibration date {calib_date.text} does not match values in calib file: {tag_date.text}\n")
+                            record_failure(review, serial_number)
+                        else:
+                            buffer.write(f"Checking {calib.tag}: {calib.text}\n")
+                            buffer.write(f"Calibration Value and Date Checks passed\n")
+                    else:
+                        buffer.write(f"Checking {calib.tag}: {calib.text}\n")
+                        buffer.write(f"Calibration Value and Date Checks passed\n")
+                else:
+                    buffer.write(f"Check FAILED: calibration {calib.tag} not found in calib file\n")
+                    record_failure(review, serial_number)
+
+    # Check Coefficients
+    check_coefficients(review, xmlcon_root, sensor_element, sensor_root, serial_number)
+
+def find_calibration_elements(xmlcon_root, tag):
+    """Find calibration elements matching a specific tag."""
+    return find_tags(xmlcon_root, tag)
+
+def format_date(calib_date_text):
+    """Format the date  to different string representations."""
+    try:
+        for fmt in ("%m/%d/%Y", "%Y-%m-%d"):
+            parsed_date = datetime.strptime(calib_date_text, fmt)
+            break
+
+        short_month = parsed_date.strftime("%b")
+        full_month = parsed_date.strftime("%B")
+        num_month = parsed_date.strftime("%m")
+        day = str(int(parsed_date.strftime("%d")))
+        full_day = parsed_date.strftime("%d")
+        year = parsed_date.strftime("%Y")
+        short_year = parsed_date.strftime("%y")
+
+        return {
+            "mdy_dash": f"{day}-{short_month}-{short_year}",
+            "mdy_dash1": f"{full_day}-{full_month}-{year}",
+            "mdy_comma": f"{full_month} {day}, {year}",
+            "mdy_slash": f"{num_month}/{day}/{year}",
+            "mdy_slash2": f"{num_month}/{day}/{short_year}",
+        }
+    except:
+        return ""
+
+def check_date_in_sensor_root(review, date_formats, sensor_root, serial_number, family=CTD):
+    """Check if the date is one of the dates in the sensor root, in any format."""
+    date = datetime.strptime(date_formats["mdy_slash"], "%m/%d/%Y").date()
+    if has_date(sensor_root, date):
+        review.buffer.write(f"Date check passed\n")
+        return True
+    if family.pdf_date_optional and "Date" not in sensor_root:
+        review.buffer.write(f"Date not found - some pdf files contain images which cannot be read\n")
+        return False
+    review.buffer.write(f"Date check failed, expecting one of {date_formats.values()}\n")
+    record_failure(review, serial_number)
+    return False
+
+def check_calibration_values(review, calib_element, sensor_root, serial_number):
+    """Check other calibration values excluding serial number and date."""
+    buffer = review.buffer
+    for calib in calib_element:
+        if calib.tag not in ['SerialNumber', 'CalibrationDate']:
+            buffer.write(f"Checking {calib.tag}: {calib.text}\n")
+            calib_value = format_calibration_value(calib.text)
+            if calib_value != ValueError:
+                if has_number(sensor_root, calib.text):
+                    buffer.write(f"Value check passed\n")
+                else:
+                    buffer.write(f"Check FAILED: calibration {calib.tag} and {calib_value} not found in calib file\n")
+                    record_failure(review, serial_number)
+            else:
+                for coef_calib in calib:     #check coefficients
+                    buffer.write(f"Checking {coef_calib.tag}: {coef_calib.text}\n")
+                    calib_value = format_calibration_value(coef_calib.text)
+                    if calib_value != ValueError:
+                        if has_number(sensor_root, coef_calib.text):
+                            buffer.write(f"Value check passed\n")
+                        else:
+                            buffer.write(f"Check FAILED: calibration {coef_calib.tag} and {coef_calib.text} not found in calib file\n")
+                            record_failure(review, serial_number)
+
+def format_calibration_value(value):
+    """Format calibration value by removing trailing zeros."""
+    try:
+        value = float(value)
+        value = str(value).rstrip('0')
+        if value.endswith('.'):
+            value = value[:-1]
+    except ValueError:
+        return ValueError
+    return value
+
+def check_pdf(review, xmlcon_root, sensor_element, sensor_root, serial_number, family=CTD):
+    """Main function to check PDF against calibration records."""
+    for element in sensor_element:
+        review.buffer.write(f"{element.tag}: {element.text}\n")
+        calib_element = find_sensor(xmlcon_root, element.tag, serial_number)
+        if calib_element:
+            calib_date = calib_element.find('CalibrationDate')
+            if calib_date.text:
+                formatted_date_str = check_date(calib_date.text)
+                date_formats = format_date(formatted_date_str)
+                if date_formats != "":
+                    check_date_in_sensor_root(review, date_formats, sensor_root, serial_number, family)
+                else:
+                    review.buffer.write(f"Date check failed, expecting {calib_date.text}\n")   # some pdf files contain images which cannot be read
+                    record_failure(review, serial_number)
+            check_calibration_values(review, calib_element, sensor_root, serial_number)
+
+def sensor_key(xmlcon_root, sensor_element, serial_number):
+    # the XMLCON elements the checks of a sensor read
+    elements = [find_sensor(xmlcon_root, element.tag, serial_number) for element in sensor_element]
+    return tuple(ET.tostring(element) if element is not None else b'' for element in elements)
+
+def check_sensor(review, xmlcon_root, sensor_element, serial_number, sensor_file, family=CTD):
+    # check a sensor against its calibration file, a sensor with the same elements is checked once per process
+    key = (family.name, sensor_file, serial_number, sensor_key(xmlcon_root, sensor_element, serial_number))
+    if key in checked_sensors:
+        checked_sensors.move_to_end(key)
+    else:
+        sensor_review = new_review()
+        sensor_root = get_data(sensor_review, sensor_file)
+        if sensor_root:
+            if sensor_file.lower().endswith(".xml"):
+                check_calibrations(sensor_review, xmlcon_root, sensor_element, sensor_root, serial_number)
+            else:
+                check_pdf(sensor_review, xmlcon_root, sensor_element, sensor_root, serial_number, family)
+        checked_sensors[key] = (sensor_review.buffer.getvalue(), sensor_review.failed_instruments)
+        if len(checked_sensors) > CHECKED_SENSORS_MAX:
+            checked_sensors.popitem(last=False)
+    report, failed_instruments = checked_sensors[key]
+    review.buffer.write(report)
+    for failed_serial_number in failed_instruments:
+        record_failure(review, failed_serial_number)
+
+def get_sensor_prefix(sensor_element, family):
+    # calibration file name prefix of the sensor, i.e. T for the underway TemperatureSensor
+    for tag, prefix in family.sensor_prefixes.items():
+        if sensor_element.find('.//' + tag) is not None:
+            return prefix
+    return ''
+
+def find_sensor_file(calib_index, sensor_element, serial_number, family):
+    return find_calib_file_with_serial_number(calib_index, serial_number, get_sensor_prefix(sensor_element, family))
+
+def confirm_calibration(review, xmlcon_file_path, calib_index, family=CTD):
+    # check every sensor with a serial number in the xmlcon file
+    xmlcon_root = get_data(review, xmlcon_file_path)
+
+    # Find all Sensor elements in xmlcon file
+    sensor_elements = find_calibration_elements(xmlcon_root, 'Sensor')
+
+    # Iterate through each Sensor element and extract the SerialNumber
+    sensors = []
+    for sensor_element in sensor_elements:
+        serial_number_element = sensor_element.find('.//SerialNumber')
+        if serial_number_element is not None:
+            serial_number = serial_number_element.text
+            if serial_number is not None:
+                # Look for sensor serial number .xml file in the calibration directory
+                sensor_file = find_sensor_file(calib_index, sensor_element, serial_number, family)
+                sensors.append((sensor_element, serial_number, sensor_file))
+
+    # download the calibration files of all sensors at once when the calibration directory is a URL
+    prefetch_documents(document_cache, [sensor_file for _, _, sensor_file in sensors if sensor_file])
+    for sensor_element, serial_number, sensor_file in sensors:
+        review.buffer.write(f"_____________________________________________________________________________________________________\n")
+        if sensor_file:
+            review.buffer.write(f"Calibration file found: {sensor_file}\n")
+            review.buffer.write(f"Sensor SerialNumber: {serial_number}\n")
+            check_sensor(review, xmlcon_root, sensor_element, serial_number, sensor_file, family)
+        else:
+            review.buffer.write(f"No Calibration file found with serial number {serial_number}\n")
+
+def compare_xmlcon_files(review, files):
+    # Group the casts by canonical XMLCON content and list the files that do not match the first configuration
+    all_files = files
+    groups = group_xmlcon_files(files)
+    files = [file for group in groups for file in group.files]
+
+    review.buffer.write(f"First XMLCON file: {files[0]}\n")
+    review.buffer.write(f"Last XMLCON file: {files[len(files)-1]}\n")
+    print(f"First XMLCON file: {files[0]}")
+    print(f"Last XMLCON file: {files[len(files)-1]}\n")
+
+    for group in groups:
+        for file in group.files:
+            if group.digest != groups[0].digest:
+                review.buffer.write(f"XMLCON file does not match: {file}\n")
+                print(f"XMLCON file does not match: {file}")
+            elif file in group.nmea_files:
+                review.buffer.write(f"XMLCON file differs only in Nmea settings: {file}\n")
+    # test casts are not grouped, but are still listed when their configuration differs
+    for file in sorted(set(all_files) - set(files)):
+        if xmlcon_digests(file)[0] != groups[0].digest:
+            review.buffer.write(f"XMLCON file does not match: {file}\n")
+            print(f"XMLCON file does not match: {file}")
+    return groups
+
+def diff_groups(groups):
+    # xmldiff only runs between the first file of the first group and the first file of each other configuration
+    return [(group.files[0], diff_xmlcon_files(groups[0].files[0], group.files[0])) for group in distinct_groups(groups)[1:]]
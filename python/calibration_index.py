@@ -0,0 +1,108 @@
+# Index of a calibration document directory (typically ctd/doc), built once per review run.
+# The directory and its subdirectories (primary_ctd_cals, or a directory per sensor serial number) are listed
+# once, then the calibration files of a serial number are looked up in memory. Lookups are memoized per serial
+# number and the working directory is never changed.
+# An http(s) directory listing is indexed from the links of the page (no subdirectories).
+# A file name prefix can be required before the serial number, i.e. the underway temperature and conductivity
+# calibrations SBE3_T4321_20230203.xml and SBE4_C4321_20230203.xml of sensors with the same serial number.
+
+from collections import namedtuple
+from datetime import datetime
+import os
+import re
+from bs4 import BeautifulSoup
+from calibration_docs import HTTP_TIMEOUT, get_session, is_url
+
+PRIMARY_DIR = 'primary_ctd_cals'
+
+# files: file names in url, directories: subdirectory name -> file names in it,
+# matches: (serial number, prefix) -> calibration file paths, newest first
+CalibrationIndex = namedtuple('CalibrationIndex', ['url', 'files', 'directories', 'matches'])
+
+def get_date_from_filename(file_name):
+    date_str = file_name.split("_")[-1].split(".")[0]
+    try:
+        return datetime.strptime(date_str, "%Y%m%d")
+    except ValueError:
+        date_pattern = re.compile(r'(\d{2}[A-Za-z]{3}\d{2})')   #date formats DDMMMYY
+        match = date_pattern.search(file_name)
+        if match:
+            # Extract the date string from the filename
+            date_str = match.group(1)
+            # Convert the date string to a datetime object
+            return datetime.strptime(date_str, '%d%b%y')
+        else:
+            # Return a default value if no date is found
+            return datetime.min
+
+def list_files(path):
+    with os.scandir(path) as entries:
+        return sorted(entry.name for entry in entries if entry.is_file())
+
+def list_url(url):
+    response = get_session().get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    soup = BeautifulSoup(response.text, 'html.parser')
+    return [a['href'] for a in soup.find_all('a') if a.has_attr('href')]
+
+def build_calibration_index(url):
+    if is_url(url):
+        return CalibrationIndex(url, list_url(url), {}, {})
+    files = []
+    directories = {}
+    with os.scandir(url) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                directories[entry.name] = list_files(entry.path)
+            elif entry.is_file():
+                files.append(entry.name)
+    return CalibrationIndex(url, sorted(files), directories, {})
+
+def get_serial_number(serial_number):
+    # the serial number text can include a prefix, i.e. 's/n 1234'
+    index = serial_number.find('s/n')
+    if index != -1:
+        serial_number = serial_number[index + 4:].strip()
+    return serial_number
+
+def search_calib_files(file_names, serial_number, prefix=''):
+    # prefix: the xml file name contains prefix + serial number, the pdf file name _ + prefix + serial number
+    matching_files = []
+    for file_name in file_names:
+        if file_name.lower().endswith(".xml") and str(serial_number) in file_name and '_Repair' not in file_name:  #prefer to use xml files
+            if prefix + str(serial_number) in file_name:
+                matching_files.append(file_name)
+    if len(matching_files) == 0:
+        for file_name in file_names:
+            if file_name.lower().endswith(".pdf") and str(serial_number) in file_name and '_Repair' not in file_name:
+                if not prefix or "_" + prefix + str(serial_number) in file_name:
+                    matching_files.append(file_name)
+    return matching_files
+
+def find_calib_files(index, serial_number, prefix=''):
+    # Return the calibration file paths for a serial number, newest (by the date in the file name) first
+    serial_number = get_serial_number(serial_number)
+    if (serial_number, prefix) in index.matches:
+        return index.matches[(serial_number, prefix)]
+
+    # look in the primary_ctd_cals folder first
+    if PRIMARY_DIR in index.directories:
+        path = os.path.join(index.url, PRIMARY_DIR)
+        file_names = index.directories[PRIMARY_DIR]
+    else:
+        path = index.url
+        file_names = index.files
+        # if a directory name contains the serial number, the calibration files are in that directory
+        for directory in sorted(index.directories):
+            if str(serial_number) in directory:
+                path = os.path.join(index.url, directory)
+                file_names = index.directories[directory]
+
+    matching_files = sorted(search_calib_files(file_names, serial_number, prefix), key=get_date_from_filename, reverse=True)
+    index.matches[(serial_number, prefix)] = [os.path.join(path, file_name).replace("\\", "/") for file_name in matching_files]
+    return index.matches[(serial_number, prefix)]
+
+def find_calib_file_with_serial_number(index, serial_number, prefix=''):
+    # pick the latest date if more than one filename matches
+    files = find_calib_files(index, serial_number, prefix)
+    return files[0] if files else None
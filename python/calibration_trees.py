@@ -0,0 +1,41 @@
+# Indexes of the XMLCON and calibration .xml element trees used by the calibration checks.
+# Each tree is walked once; the index is kept as long as the tree (the document cache returns the same tree
+# for every sensor and every group file), so the checks are dictionary lookups instead of findall('.//tag')
+# walks of the whole tree for every coefficient.
+
+import weakref
+
+# element tree root -> index
+xmlcon_indexes = weakref.WeakKeyDictionary()
+tag_indexes = weakref.WeakKeyDictionary()
+
+def tag_index(root):
+    # tag -> elements below the root in document order, the same elements as root.findall('.//' + tag)
+    if root not in tag_indexes:
+        index = {}
+        for element in root.iter():
+            if element is not root:
+                index.setdefault(element.tag, []).append(element)
+        tag_indexes[root] = index
+    return tag_indexes[root]
+
+def xmlcon_index(xmlcon_root):
+    # (element tag, serial number) -> first element with that tag and SerialNumber, i.e. ('TemperatureSensor', '4321')
+    if xmlcon_root not in xmlcon_indexes:
+        index = {}
+        for element in xmlcon_root.iter():
+            serial = element.find('SerialNumber')
+            if serial is not None:
+                index.setdefault((element.tag, serial.text), element)
+        xmlcon_indexes[xmlcon_root] = index
+    return xmlcon_indexes[xmlcon_root]
+
+def find_tags(root, tag):
+    return tag_index(root).get(tag, [])
+
+def find_tag(root, tag):
+    elements = find_tags(root, tag)
+    return elements[0] if elements else None
+
+def find_sensor(xmlcon_root, tag, serial_number):
+    return xmlcon_index(xmlcon_root).get((tag, serial_number))
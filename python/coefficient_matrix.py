@@ -0,0 +1,160 @@
+# Compare the calibration coefficients of every XMLCON in a cruise with the calibration .xml files in one pass.
+# Every XMLCON is turned into rows of a table:
+#     cast, slot (Sensor index), sensor (i.e. TemperatureSensor), serial, coefficient, equation, value
+# equation is the position of the <Coefficients> element in the sensor (0, 1), -1 for values outside one.
+# The calibration .xml file of each serial number is turned into the same rows, the tables are joined and all
+# values are compared at once with numpy (isclose with --rtol and --atol, default: exact match as in ctd_review.py).
+# The result lists each difference once, with the casts that have it:
+#     serial,sensor,coefficient,equation,xmlcon_value,calibration_value,casts
+#     4322,TemperatureSensor,G,-1,0.00433,0.0044,004-006
+# The XMLCON files and the calibration file name prefix of a sensor follow the rules of the instrument family
+# (see calibration_engine.py), --underway for the underway XMLCONs.
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from calibration_docs import DOCUMENT_CACHE_FILE, open_document_cache, close_document_cache, load_document
+from calibration_engine import CTD, UNDERWAY, find_xmlcon_files
+from calibration_index import build_calibration_index, find_calib_file_with_serial_number, get_serial_number
+from xmlcon_groups import get_cast, cast_order
+
+COLUMNS = ['cast', 'slot', 'sensor', 'serial', 'coefficient', 'equation', 'value']
+KEY = ['serial', 'sensor', 'coefficient', 'equation']
+COEFFICIENT_TAGS = ('Coefficients', 'CalibrationCoefficients')
+SKIPPED_TAGS = ('SerialNumber', 'CalibrationDate')
+
+def to_float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+def sensor_rows(sensor, cast='', slot=-1):
+    # rows of one sensor element (the element with the SerialNumber), same order as the ctd_review checks
+    serial = sensor.find('SerialNumber').text
+    rows = []
+    equation = 0
+    for calib in sensor:
+        if calib.tag in COEFFICIENT_TAGS:
+            for coef in calib.iter():
+                if coef is not calib:
+                    rows.append((cast, slot, sensor.tag, serial, coef.tag, equation, to_float(coef.text)))
+            equation += 1
+        elif calib.tag not in SKIPPED_TAGS:
+            rows.append((cast, slot, sensor.tag, serial, calib.tag, -1, to_float(calib.text)))
+    return rows
+
+def xmlcon_rows(file, xmlcon_root):
+    rows = []
+    cast = get_cast(file)
+    for slot, sensor_element in enumerate(xmlcon_root.iter('Sensor')):
+        slot = int(sensor_element.get('index', slot))
+        for sensor in sensor_element:
+            if sensor.find('SerialNumber') is not None and sensor.find('SerialNumber').text:
+                rows.extend(sensor_rows(sensor, cast, slot))
+    return rows
+
+def extract_matrix(files, document_cache):
+    # one row per cast, sensor and coefficient, numeric values in a float64 column
+    rows = []
+    for file in sorted(files, key=cast_order):
+        rows.extend(xmlcon_rows(file, load_document(document_cache, file)))
+    matrix = pd.DataFrame(rows, columns=COLUMNS)
+    matrix['value'] = matrix['value'].astype(np.float64)
+    return matrix
+
+def reference_matrix(sensors, calib_index, document_cache, family=CTD):
+    # rows of the calibration .xml file of each (serial number, sensor tag), serial numbers with a .pdf or no
+    # file are listed
+    rows = []
+    no_xml = []
+    for serial, sensor_tag in sensors:
+        calib_file = find_calib_file_with_serial_number(calib_index, serial, family.sensor_prefixes.get(sensor_tag, ''))
+        if calib_file is None or not calib_file.lower().endswith('.xml'):
+            no_xml.append((serial, calib_file))
+            continue
+        for sensor in load_document(document_cache, calib_file).iter():
+            serial_number = sensor.find('SerialNumber')
+            if serial_number is not None and get_serial_number(serial_number.text or '') == get_serial_number(serial):
+                rows.extend(row[:3] + (serial,) + row[4:] for row in sensor_rows(sensor))
+                break
+    reference = pd.DataFrame(rows, columns=COLUMNS).drop(columns=['cast', 'slot']).drop_duplicates(KEY)
+    return reference.rename(columns={'value': 'calibration_value'}), no_xml
+
+def fill_single_occurrences(merged, reference):
+    # like ctd_review, a coefficient that is in the calibration file once is used for every equation
+    coefficients = reference[reference['equation'] >= 0]
+    single = coefficients.groupby(['serial', 'coefficient'])['calibration_value'].agg(['first', 'size'])
+    single = single[single['size'] == 1]['first']
+    missing = merged['calibration_value'].isna() & (merged['equation'] >= 0)
+    keys = pd.MultiIndex.from_frame(merged.loc[missing, ['serial', 'coefficient']])
+    merged.loc[missing, 'calibration_value'] = single.reindex(keys).to_numpy()
+    return merged
+
+def cast_ranges(casts):
+    # '001', '002', '003', '007' -> '001-003, 007'
+    ranges = []
+    for cast in sorted(casts, key=lambda cast: (0, int(cast)) if cast.isdigit() else (1, cast)):
+        if ranges and cast.isdigit() and ranges[-1][1].isdigit() and int(cast) == int(ranges[-1][1]) + 1:
+            ranges[-1][1] = cast
+        else:
+            ranges.append([cast, cast])
+    return ', '.join(first if first == last else f"{first}-{last}" for first, last in ranges)
+
+def compare_matrix(matrix, reference, rtol=0.0, atol=0.0):
+    # Return the coefficients that differ from (or are missing in) the calibration files, with their casts
+    merged = matrix.merge(reference, on=KEY, how='left')
+    merged = fill_single_occurrences(merged, reference)
+    values = merged['value'].to_numpy()
+    calibration_values = merged['calibration_value'].to_numpy()
+    has_reference = merged['serial'].isin(reference['serial']).to_numpy()
+    differs = has_reference & ~np.isclose(values, calibration_values, rtol=rtol, atol=atol, equal_nan=True)
+    differences = merged[differs]
+    if differences.empty:
+        return pd.DataFrame(columns=KEY + ['xmlcon_value', 'calibration_value', 'casts'])
+    table = (differences.groupby(KEY + ['value', 'calibration_value'], dropna=False, sort=False)['cast']
+             .agg(cast_ranges).reset_index())
+    return table.rename(columns={'value': 'xmlcon_value', 'cast': 'casts'})
+
+def compare_coefficients(xmlcon_path, calib_path, rtol=0.0, atol=0.0, document_cache=None, matrix_file=None, family=CTD):
+    document_cache = document_cache or open_document_cache()
+    files = find_xmlcon_files(xmlcon_path, family)
+    matrix = extract_matrix(files, document_cache)
+    print(f"Extracted {len(matrix)} coefficients of {matrix['serial'].nunique()} sensors from {len(files)} XMLCON files")
+    if matrix_file:
+        matrix.to_csv(matrix_file, index=False)
+    sensors = matrix[['serial', 'sensor']].drop_duplicates().itertuples(index=False)
+    reference, no_xml = reference_matrix(sensors, build_calibration_index(calib_path), document_cache, family)
+    for serial, calib_file in no_xml:
+        print(f"No calibration .xml file for serial number {serial}" + (f", found {calib_file}" if calib_file else ""))
+    return compare_matrix(matrix, reference, rtol, atol)
+
+def main():
+    # If paths are on Google Docs, you must download the files to your local pc file system.
+    parser = argparse.ArgumentParser(description='Compare the coefficients of all CTD XMLCON files of a cruise with the calibration .xml files.')
+    parser.add_argument('path', type=str, help='Path to ctd xmlcon directory')
+    parser.add_argument('calib', type=str, help='Path to Calibration file directory')   # typically is ctd/doc dir
+    parser.add_argument('--rtol', type=float, default=0.0, help='Relative tolerance (default: 0, exact match)')
+    parser.add_argument('--atol', type=float, default=0.0, help='Absolute tolerance (default: 0, exact match)')
+    parser.add_argument('--output', type=str, default=None, help='Write the differences to this CSV file')
+    parser.add_argument('--matrix', type=str, default=None, help='Write all extracted coefficients to this CSV file')
+    parser.add_argument('--doc-cache', type=str, default=DOCUMENT_CACHE_FILE, help=f'SQLite file with the parsed calibration documents of previous reviews (default: {DOCUMENT_CACHE_FILE})')
+    parser.add_argument('--no-doc-cache', action='store_true', help='Read every calibration document again and do not update the cache')
+    parser.add_argument('--underway', action='store_true', help='The path is an underway (tsg) xmlcon directory')
+
+    args = parser.parse_args()
+
+    document_cache = open_document_cache(None if args.no_doc_cache else args.doc_cache)
+    differences = compare_coefficients(args.path, args.calib, args.rtol, args.atol, document_cache, args.matrix,
+                                       UNDERWAY if args.underway else CTD)
+    close_document_cache(document_cache)
+    if differences.empty:
+        print("All coefficients match the calibration files.")
+    else:
+        print(differences.to_string(index=False))
+    if args.output:
+        differences.to_csv(args.output, index=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# Review the CTD calibrations of many cruises in one run, i.e. the whole archive after a calibration directory fix:
+#     python ctd_batch_review.py "D:\...\ship-provided_data_*\ctd\raw" --workers 4
+# Every cruise is reviewed by ctd_review.review_data with its own summary, report buffer and failed instrument
+# list, and gets its own CRUISE_ctd_calibration_results.txt.
+# The calibration directory of a cruise is the ctd/doc directory next to its xmlcon directory, or --calib for all
+# cruises. Each calibration directory is indexed once and the index is sent to the workers; the workers share the
+# on-disk document cache (--doc-cache), so a calibration sheet used by several cruises is parsed once.
+# With --underway the underway XMLCONs of a cruise (CRUISE/tsg/raw, calibrations in CRUISE/tsg/docs/calibrations)
+# are reviewed by underway_review.review_data in the same worker, right after the CTD, so calibration sheets
+# used by both are read and checked once (see calibration_engine.py).
+# The failed instruments of all cruises are written to one table:
+#     instrument,cruise,serial_number,results_file
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import csv
+from glob import glob, has_magic
+from io import StringIO
+from multiprocessing.util import Finalize
+import os
+import ctd_review
+import underway_review
+import calibration_engine as engine
+from calibration_docs import DOCUMENT_CACHE_FILE, open_document_cache, close_document_cache, cache_report
+from calibration_index import build_calibration_index
+
+FAILED_INSTRUMENTS_FILE = 'ctd_calibration_failed_instruments.csv'
+
+def find_cruise_paths(patterns):
+    # cruise xmlcon directories from paths and glob patterns, in the order given, each once
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob(pattern)) if has_magic(pattern) else [pattern])
+    return list(dict.fromkeys(paths))
+
+def get_calib_dir(xmlcon_file_path):
+    # ctd/raw -> ctd/doc
+    return os.path.join(os.path.dirname(os.path.normpath(xmlcon_file_path)), 'doc')
+
+def get_underway_dirs(xmlcon_file_path):
+    # CRUISE/ctd/raw -> (CRUISE/tsg/raw, CRUISE/tsg/docs/calibrations), or None if the cruise has no tsg/raw
+    cruise_dir = os.path.dirname(os.path.dirname(os.path.normpath(xmlcon_file_path)))
+    underway_path = os.path.join(cruise_dir, 'tsg', 'raw')
+    if not os.path.isdir(underway_path):
+        return None
+    return underway_path, os.path.join(cruise_dir, 'tsg', 'docs', 'calibrations')
+
+def init_worker(indexes, cache_file):
+    engine.calib_indexes.update(indexes)
+    engine.set_document_cache(open_document_cache(cache_file))
+
+def init_pool_worker(indexes, cache_file):
+    # a pool worker exits with os._exit, so the cache is closed by a multiprocessing finalizer, not atexit
+    init_worker(indexes, cache_file)
+    Finalize(None, close_document_cache, args=(engine.document_cache,), exitpriority=10)
+
+def review_cruise(reviews):
+    # run the reviews of one cruise: (instrument, xmlcon path, calibration path), return the log output and
+    # (instrument, cruise name, results file, failed instruments) of each review that finished
+    results = []
+    with redirect_stdout(StringIO()) as log:
+        for instrument, xmlcon_file_path, calib_file_path in reviews:
+            review_data = ctd_review.review_data if instrument == engine.CTD.name else underway_review.review_data
+            try:
+                results.append((instrument,) + review_data(xmlcon_file_path, calib_file_path))
+            except Exception as e:
+                print(f"ERROR: Could not review {xmlcon_file_path}: {e}")
+    return log.getvalue(), results
+
+def write_failed_instruments(output, results):
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['instrument', 'cruise', 'serial_number', 'results_file'])
+        for instrument, cruise_name, results_file, failed_instruments in results:
+            for serial_number in failed_instruments:
+                writer.writerow([instrument, cruise_name, serial_number, results_file])
+
+def review_cruises(patterns, calib=None, workers=1, cache_file=None, output=None, underway=False):
+    cruises = []
+    for path in find_cruise_paths(patterns):
+        reviews = [(engine.CTD.name, path, calib or get_calib_dir(path))]
+        if underway and get_underway_dirs(path):
+            reviews.append((engine.UNDERWAY.name,) + get_underway_dirs(path))
+        cruises.append(reviews)
+    print(f"Reviewing {len(cruises)} cruises")
+    indexes = {}
+    for calib_file_path in dict.fromkeys(calib_file_path for reviews in cruises for _, _, calib_file_path in reviews):
+        if os.path.isdir(calib_file_path):
+            indexes[calib_file_path] = build_calibration_index(calib_file_path)
+
+    if workers > 1 and len(cruises) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_pool_worker, initargs=(indexes, cache_file)) as executor:
+            reviewed = list(executor.map(review_cruise, cruises))
+    else:
+        init_worker(indexes, cache_file)
+        reviewed = [review_cruise(cruise) for cruise in cruises]
+        print(cache_report(engine.document_cache))
+        close_document_cache(engine.document_cache)
+
+    results = []
+    for log, cruise_results in reviewed:
+        print(log, end='')
+        for result in cruise_results:
+            instrument, cruise_name, results_file, failed_instruments = result
+            print(f"{cruise_name} {instrument}: {len(failed_instruments)} failed instruments, see {results_file}")
+            results.append(result)
+    output = output or os.path.join(ctd_review.current_dir, FAILED_INSTRUMENTS_FILE)
+    write_failed_instruments(output, results)
+    print(f"Completed {len(results)} of {sum(len(reviews) for reviews in cruises)} reviews, failed instruments: {output}")
+    return results
+
+def main():
+    # If paths are on Google Docs, you must download the files to your local pc file system.
+    parser = argparse.ArgumentParser(description='Review the CTD calibrations of several cruises prior to upload to RDS for NES-LTER REST API.')
+    parser.add_argument('path', type=str, nargs='+', help='Path to ctd xmlcon directory of each cruise, or a glob pattern')
+    parser.add_argument('--calib', type=str, default=None, help='Calibration file directory used for every cruise (default: the ctd/doc directory of each cruise)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes reviewing cruises in parallel (default: number of cpus)')
+    parser.add_argument('--output', type=str, default=None, help=f'CSV file with the failed instruments of all cruises (default: {FAILED_INSTRUMENTS_FILE})')
+    parser.add_argument('--doc-cache', type=str, default=DOCUMENT_CACHE_FILE, help=f'SQLite file with the parsed calibration documents, shared by the workers (default: {DOCUMENT_CACHE_FILE}, see calibration_docs.py)')
+    parser.add_argument('--no-doc-cache', action='store_true', help='Read every calibration document again and do not update the cache')
+    parser.add_argument('--underway', action='store_true', help='Also review the underway XMLCONs (tsg/raw) of each cruise')
+
+    args = parser.parse_args()
+
+    review_cruises(args.path, args.calib, args.workers, None if args.no_doc_cache else args.doc_cache, args.output, args.underway)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+# Review the scan data of processed CTD casts (.cnv, or .asc files exported with SBE ASCII Out).
+# ctd_hdr_review.py checks the # span lines of the header, which can hide spikes and does not check
+# conductivity and oxygen voltage. This script reads every scan and, per channel, in one pass:
+#     counts the scans and the NaN (bad_flag) values
+#     finds the min and max
+#     counts the values outside the sensor limits, only in the scans with the pumps on when the cast has a
+#     pumps channel (the surface soak and the deck scans are outside most limits), --all-scans for every scan
+# and compares the min and max with the header spans.
+# Binary .cnv files are memory-mapped, ascii .cnv and .asc files are read in chunks, so large 24 Hz casts
+# are never loaded as a whole.
+# The limits are the header review SENSOR_LIMITS plus DATA_LIMITS, a --limits CSV file (name,min,max) overrides them.
+
+import argparse
+from collections import namedtuple
+import csv
+from glob import glob
+import os
+import numpy as np
+import pandas as pd
+from ctd_hdr_review import Finding, SENSOR_LIMITS, format_finding, is_cast_file
+from seabird_header import parse_header, prefer_header_files, read_header_bytes
+
+# limits for the channels that have no range in SENSOR_LIMITS (0, 0)
+DATA_LIMITS = {
+    "c0S/m": {"min": 0, "max": 7},
+    "c1S/m": {"min": 0, "max": 7},
+    "sbeox0V": {"min": 0, "max": 5},
+    "sbeox1V": {"min": 0, "max": 5},
+}
+
+DEFAULT_BAD_FLAG = -9.990e-29
+CHUNK_ROWS = 100000
+# relative difference allowed between the data min, max and the header span (the span is rounded)
+SPAN_TOLERANCE = 1e-3
+PUMPS = 'pumps'
+
+# column: position in the scan, span: (min, max) from the header or None
+ChannelStats = namedtuple('ChannelStats', ['column', 'name', 'count', 'nan_count', 'min', 'max', 'out_of_range', 'span'])
+
+def default_limits():
+    limits = {name: dict(limit) for name, limit in SENSOR_LIMITS.items()}
+    limits.update({name: dict(limit) for name, limit in DATA_LIMITS.items()})
+    return limits
+
+def read_limits(limits_file):
+    limits = default_limits()
+    with open(limits_file, newline='') as f:
+        for row in csv.DictReader(f):
+            limits[row['name'].strip()] = {"min": float(row['min']), "max": float(row['max'])}
+    return limits
+
+def header_value(lines, key):
+    # value of a '# key = value' header line, or None
+    for line in lines:
+        if line.startswith('# ' + key):
+            return line.split('=', 1)[1].strip()
+    return None
+
+def read_cnv_chunks(file, header, lines, columns, chunk_rows):
+    offset = len(header)
+    if (header_value(lines, 'file_type') or 'ascii').lower() == 'binary':
+        # 4 byte little endian floats, one row of columns per scan
+        scans = np.memmap(file, dtype='<f4', mode='r', offset=offset)
+        scans = scans[:len(scans) - len(scans) % columns].reshape(-1, columns)
+        for start in range(0, len(scans), chunk_rows):
+            yield np.asarray(scans[start:start + chunk_rows], dtype=np.float64)
+    else:
+        with open(file, 'rb') as f:
+            f.seek(offset)
+            for chunk in pd.read_csv(f, sep=r'\s+', header=None, dtype=np.float64, chunksize=chunk_rows, engine='c'):
+                yield chunk.to_numpy()[:, :columns]
+
+def read_asc_chunks(file, chunk_rows):
+    for chunk in pd.read_csv(file, sep=r'\s+', dtype=np.float64, chunksize=chunk_rows, engine='c'):
+        yield chunk.to_numpy()
+
+def asc_header(file):
+    # .asc files have only a row of column names, the spans come from the .hdr or .cnv file of the cast
+    with open(file, encoding='latin-1') as f:
+        names = f.readline().split()
+    stem = os.path.splitext(file)[0]
+    for extension in ('.hdr', '.cnv'):
+        if os.path.exists(stem + extension):
+            return names, parse_header(read_header_bytes(stem + extension).decode('latin-1').splitlines(), file)
+    return names, None
+
+def scan_statistics(chunks, columns, low, high, bad_flag, pumps_column=None):
+    # Accumulate count, NaN count, min, max and out of range count per column over all chunks. With a
+    # pumps_column only the scans with the pumps on (1) are checked against the limits, checked_count is
+    # the number of those scans
+    count = 0
+    checked_count = 0
+    nan_count = np.zeros(columns, dtype=np.int64)
+    out_of_range = np.zeros(columns, dtype=np.int64)
+    minimum = np.full(columns, np.nan)
+    maximum = np.full(columns, np.nan)
+    for chunk in chunks:
+        if bad_flag is not None:
+            chunk = np.where(np.isclose(chunk, bad_flag, rtol=1e-6, atol=0), np.nan, chunk)
+        count += len(chunk)
+        nan_count += np.isnan(chunk).sum(axis=0)
+        checked = chunk if pumps_column is None else chunk[chunk[:, pumps_column] == 1]
+        checked_count += len(checked)
+        # comparisons with NaN are False, so NaN values and unlimited (NaN limit) columns are not counted
+        out_of_range += ((checked < low) | (checked > high)).sum(axis=0)
+        if len(chunk):
+            # fmin and fmax ignore NaN values
+            minimum = np.fmin(minimum, np.fmin.reduce(chunk, axis=0))
+            maximum = np.fmax(maximum, np.fmax.reduce(chunk, axis=0))
+    return count, checked_count, nan_count, minimum, maximum, out_of_range
+
+def review_scans(file, limits, chunk_rows=CHUNK_ROWS, all_scans=False):
+    # Returns the channel statistics and the findings of one .cnv or .asc file
+    if file.lower().endswith('.asc'):
+        names, record = asc_header(file)
+        # .asc column names are capitalized differently (i.e. PrDM), match the header names without case
+        numbers = {}
+        if record:
+            for number, (name, _) in record.variables.items():
+                numbers.setdefault(name.lower(), number)
+        spans = [record.spans.get(numbers.get(name.lower())) if record else None for name in names]
+        bad_flag = DEFAULT_BAD_FLAG
+        chunks = read_asc_chunks(file, chunk_rows)
+    else:
+        header = read_header_bytes(file)
+        lines = header.decode('latin-1').splitlines()
+        record = parse_header(lines, file)
+        order = sorted(record.variables, key=int)
+        names = [record.variables[number][0] for number in order]
+        spans = [record.spans.get(number) for number in order]
+        bad_flag = float(header_value(lines, 'bad_flag') or DEFAULT_BAD_FLAG)
+        chunks = read_cnv_chunks(file, header, lines, len(names), chunk_rows)
+
+    limits_by_name = {name.lower(): limit for name, limit in limits.items()}
+    low = np.array([limits_by_name.get(name.lower(), {}).get("min", np.nan) for name in names], dtype=np.float64)
+    high = np.array([limits_by_name.get(name.lower(), {}).get("max", np.nan) for name in names], dtype=np.float64)
+    lower_names = [name.lower() for name in names]
+    pumps_column = lower_names.index(PUMPS) if PUMPS in lower_names and not all_scans else None
+    if pumps_column is not None:
+        # the pumps limit is the filter
+        low[pumps_column] = high[pumps_column] = np.nan
+    count, checked_count, nan_count, minimum, maximum, out_of_range = scan_statistics(chunks, len(names), low, high, bad_flag, pumps_column)
+    scans = "scans" if pumps_column is None else "scans with the pumps on"
+
+    stats = []
+    findings = []
+    for column, name in enumerate(names):
+        span = spans[column]
+        stats.append(ChannelStats(column, name, count, int(nan_count[column]), minimum[column], maximum[column],
+                                  int(out_of_range[column]), span))
+        if out_of_range[column]:
+            fraction = out_of_range[column] / checked_count
+            findings.append(Finding('ERROR', 'data', file, f"Sensor {name} {out_of_range[column]} of {checked_count} {scans} ({fraction:.2%}) "
+                                    f"not within min and max range {{'min': {low[column]:g}, 'max': {high[column]:g}}}, data {minimum[column]:g} : {maximum[column]:g}"))
+        if nan_count[column]:
+            findings.append(Finding('WARNING', 'data', file, f"Sensor {name} has {nan_count[column]} of {count} scans with no value"))
+        if span and count > nan_count[column]:
+            try:
+                span_min, span_max = float(span[0]), float(span[1])
+            except ValueError:
+                findings.append(Finding('ERROR', 'spans', file, f"Sensor {name} span {span[0]}, {span[1]} is not numeric"))
+                continue
+            if (not np.isclose(minimum[column], span_min, rtol=SPAN_TOLERANCE, atol=SPAN_TOLERANCE) or
+                    not np.isclose(maximum[column], span_max, rtol=SPAN_TOLERANCE, atol=SPAN_TOLERANCE)):
+                findings.append(Finding('WARNING', 'spans', file, f"Sensor {name} data {minimum[column]:g} : {maximum[column]:g} "
+                                        f"does not match header span {span[0]} : {span[1]}"))
+    if count == 0:
+        findings.append(Finding('ERROR', 'data', file, f"No scans found"))
+    return stats, findings
+
+def find_scan_files(url):
+    # .cnv files, or the .asc file for casts that were delivered without a .cnv
+    files = prefer_header_files(glob(os.path.join(url, '*.cnv')) + glob(os.path.join(url, '*.asc')), ('.cnv', '.asc'))
+    return [file for file in files if is_cast_file(file)]
+
+def write_statistics(stats_file, results):
+    with open(stats_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['file', 'column', 'name', 'scans', 'nan_count', 'min', 'max', 'out_of_range', 'span_min', 'span_max'])
+        for file, stats in results:
+            for channel in stats:
+                span_min, span_max = channel.span if channel.span else ('', '')
+                writer.writerow([file, channel.column, channel.name, channel.count, channel.nan_count,
+                                 f"{channel.min:g}", f"{channel.max:g}", channel.out_of_range, span_min, span_max])
+
+def review_data(url, limits, chunk_rows=CHUNK_ROWS, stats_file=None, all_scans=False):
+    files = [url] if os.path.isfile(url) else find_scan_files(url)
+    print(f"Checking scan data of {len(files)} processed CTD files for sensor ranges")
+    errors_found = len(files) == 0
+    results = []
+    for file in files:
+        try:
+            stats, findings = review_scans(file, limits, chunk_rows, all_scans)
+        except Exception as e:
+            # a malformed scan (i.e. a non-numeric value in an ascii .cnv) fails this file, not the review
+            stats, findings = [], [Finding('ERROR', 'data', file, f"Could not read the scan data: {e}")]
+        results.append((file, stats))
+        reported = [finding for finding in findings if finding.severity != 'OK']
+        if reported:
+            print(f"\n{file}")
+            for finding in reported:
+                print(format_finding(finding))
+        errors_found = errors_found or any(finding.severity == 'ERROR' for finding in findings)
+    if stats_file:
+        write_statistics(stats_file, results)
+    print(f"\nERRORS FOUND!" if errors_found else f"\nNO ERRORS FOUND.")
+    return results
+
+def main():
+    # If paths are on Google Docs, you must download the files to your local pc file system.
+    parser = argparse.ArgumentParser(description='Review the scan data of processed CTD files (.cnv or .asc) for sensor ranges and spikes.')
+    parser.add_argument('path', type=str, help='Path to CTD processed .cnv (or .asc) directory, or one file')
+    parser.add_argument('--limits', type=str, default=None, help='CSV file with name,min,max rows that override the sensor limits')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help=f'Number of scans read at a time (default: {CHUNK_ROWS})')
+    parser.add_argument('--stats', type=str, default=None, help='Write the min, max, NaN and out of range counts per channel to this CSV file')
+    parser.add_argument('--all-scans', action='store_true', help='Check the sensor limits on every scan, also while the pumps are off')
+
+    args = parser.parse_args()
+
+    limits = read_limits(args.limits) if args.limits else default_limits()
+    review_data(args.path, limits, args.chunk_rows, args.stats, args.all_scans)
+
+if __name__ == '__main__':
+    main()
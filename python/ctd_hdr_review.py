@@ -3,159 +3,35 @@
 #     modulo errors from cable problems
 #     includes sensors that you care about
 #     min, max range checks for sensors 
+# Each check returns Finding records. Header files (of one or more cruises) are checked in parallel
+# and the findings are grouped into an HTML report per cruise at the end.
+# Findings are cached in a SQLite file, so files that have not changed since the last review are not checked again.
+# The cache is in the user's cache directory (~/.cache/nes-lter-ims-utils), --cache for another file.
 
 import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
 import os
+import sqlite3
 from io import StringIO
 import re
 from glob import glob
-
-buffer = StringIO()
+from seabird_header import parse_header, prefer_header_files, read_header_bytes
 
 current_dir = os.getcwd()
-errors_found = False
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'nes-lter-ims-utils', 'ctd_hdr_review_cache.sqlite')
 
-def find_hdr_files(url):
-    global errors_found
-    matching_files = []
-    for file in glob(os.path.join(url, '*.hdr')):
-        # get base filename
-        filename = os.path.splitext(os.path.basename(file))[0]
-        if ('_u' not in filename and
-            not (filename.startswith("dar") or filename.startswith("uar")) and
-            '_up' not in filename and
-            '_down' not in filename):
-            matching_files.append(file)
-    return matching_files
+# change when the checks change so that cached findings from older checks are not reused
+CHECKS_VERSION = '2'
 
-def check_nmea(file_path):
-    global errors_found
-    latitude = ''
-    longitude = ''
+# severity: ERROR, NOTE (listed in the report and fail the review), WARNING (listed in the report) or OK
+Finding = namedtuple('Finding', ['severity', 'check', 'file', 'message'])
+FAILING = ('ERROR', 'NOTE')
+REPORTED = ('ERROR', 'NOTE', 'WARNING')
 
-    try:
-        with open(file_path, 'r') as file:
-            # Read all lines from the file
-            lines = file.readlines()
-
-            # Search for the string in each line
-            for line_number, line in enumerate(lines, start=1):
-                pattern = r'NMEA Latitude = (\d+) (\d+\.\d+) (\w)'
-                # Use re.search to find the match
-                match = re.search(pattern, line)
-                # Extract the matched value
-                if match:
-                    latitude = match.group(1)
-                    dir = match.group(3)
-                    if dir == "S":
-                        latitude = -int(latitude)
-                    if int(latitude) < 37 or int(latitude) > 43:
-                       print(f"ERROR: NMEA Latitude {latitude} {dir} outside of range 37 to 43")
-                       buffer.write(f"<strong>ERROR:</strong> NMEA Latitude {latitude} outside of range 37 to 43<br>")
-                       errors_found = True
-                       
-                pattern = r'NMEA Longitude = (\d+) (\d+\.\d+) (\w)'
-                # Use re.search to find the match
-                match = re.search(pattern, line)
-                # Extract the matched value
-                if match:
-                    longitude = match.group(1)
-                    dir = match.group(3)
-                    if dir == "W":
-                        longitude = -int(longitude)
-                    if int(longitude) > -67 or int(longitude) < -72:
-                       print(f"ERROR: NMEA Longitude {longitude} outside of range -67 to -72")
-                       buffer.write(f"<strong>ERROR:</strong> NMEA Longitude {longitude} outside of range -67 to -72<br>")
-                       errors_found = True
-                       
-            if latitude == '':
-                print(f"ERROR: NMEA Latitude not found")
-                buffer.write(f"<strong>ERROR:</strong> NMEA Latitude not found<br>")
-                errors_found = True
-            
-                
-            if longitude == '':
-                print(f"ERROR: NMEA Longitude not found")
-                buffer.write(f"<strong>ERROR:</strong> NMEA Longitude not found<br>")
-                errors_found = True
- 
-                    
-    except FileNotFoundError:
-        print(f"File not found: {file}")
-        buffer.write(f"File not found: {file}<br>")
-
-def check_modulo(file_path):
-
-    try:
-        with open(file_path, 'r') as file:
-            # Read all lines from the file
-            lines = file.readlines()
-
-            # Search for the string in each line
-            for line_number, line in enumerate(lines, start=1):
-                if "modError" in line:
-                    print(f"ERROR: modError found in file")
-                    buffer.write(f"<strong>ERROR:</strong> modError found in file<br>")
-                    errors_found = True
-                    
-    except FileNotFoundError:
-        print(f"File not found: {file}")
-        buffer.write(f"File not found: {file}<br>")
-        
-def summarize_errors():
-    error_files = {}
-
-    # Split the buffer content into sections for each file
-    sections = buffer.getvalue().split("Checking ")
-
-    for section in sections[1:]:  # Skip the first empty section
-        lines = section.strip().split('<br>')
-        file_path = lines[0].strip()
-        
-        for line in lines[1:]:
-            if "ERROR:" in line or "NOTE:" in line or "Duplicate Variable Names Found" in line:
-               error_files.setdefault(line, set()).add(file_path)
-
-    return error_files
-        
-def check_duplicates(file):
-    seen = set()
-    duplicates = []
-    
-    with open(file, 'r') as file:
-        file.seek(0)
-            
-        # Define the variable pattern name in the file
-        pattern = re.compile(r'# name \d+ = (\w+):')
-            
-        # Find all the variable names
-        for line in file:
-            # Try to match the pattern in the current line
-            match = pattern.match(line)
-            if match:
-                # Extract name from the matched pattern
-                name = match.group(1)
-                if name in seen:
-                    duplicates.append(name)
-                else:
-                   seen.add(name)
-
-    if duplicates:
-        print("Duplicate Variable Names Found:")
-        buffer.write(f"Duplicate Variable Names Found:")
-        for duplicate in duplicates:
-            print(duplicate)
-            buffer.write(f" {duplicate}, ")
-    else:
-        print("No Duplicate Variable Names Found.")
-        buffer.write(f"No Duplicate Variable Names Found.")
-        
-    buffer.write(f"<br>")
-
-    
-def check_sensor_data(file):
-    global errors_found
-    sensor_limits = {
+SENSOR_LIMITS = {
     "prDM": {"min": 0, "max": 510},
     "t090C": {"min": -5, "max": 35},
     "t190C": {"min": -5, "max": 35},
@@ -173,108 +49,201 @@ def check_sensor_data(file):
     "sbeox1V": {"min": 0, "max": 0},
 }
 
-    sensors_info = []
-
-    # Open and read the hdr file
-    with open(file, 'r') as file:
-
-        for idx in sensor_limits:
-            found = False
-            file.seek(0)
-            
-            # Define the sensor pattern in hdr file
-            pattern = re.compile(r'# name (\d+) = ' + re.escape(idx) + r': (\w+)')
-            
-            # Iterate through each line in the file
-            for line in file:
-                # Try to match the pattern in the current line
-                match = pattern.match(line)
-                if match:
-                    # Extract information from the matched pattern
-                    number = match.group(1)
-                    full_name = match.group(2)
-                
-                    sensor_info = {"value": idx, "number": number, "full_name": full_name}
+def is_cast_file(file):
+    # skip the up, down and u/d/uar cast files, only the full cast is reviewed
+    # get base filename
+    filename = os.path.splitext(os.path.basename(file))[0]
+    return ('_u' not in filename and
+            not (filename.startswith("dar") or filename.startswith("uar")) and
+            '_up' not in filename and
+            '_down' not in filename)
+
+def find_hdr_files(url):
+    # .hdr files, or the .cnv file for casts that were delivered without a .hdr
+    files = prefer_header_files(glob(os.path.join(url, '*.hdr')) + glob(os.path.join(url, '*.cnv')), ('.hdr', '.cnv'))
+    return [file for file in files if is_cast_file(file)]
+
+def check_nmea(record):
+    findings = []
+
+    if record.latitude:
+        latitude, minutes, dir = record.latitude
+        if dir == "S":
+            latitude = -int(latitude)
+        if int(latitude) < 37 or int(latitude) > 43:
+            findings.append(Finding('ERROR', 'nmea', record.file, f"NMEA Latitude {latitude} outside of range 37 to 43"))
+    else:
+        findings.append(Finding('ERROR', 'nmea', record.file, f"NMEA Latitude not found"))
+
+    if record.longitude:
+        longitude, minutes, dir = record.longitude
+        if dir == "W":
+            longitude = -int(longitude)
+        if int(longitude) > -67 or int(longitude) < -72:
+            findings.append(Finding('ERROR', 'nmea', record.file, f"NMEA Longitude {longitude} outside of range -67 to -72"))
+    else:
+        findings.append(Finding('ERROR', 'nmea', record.file, f"NMEA Longitude not found"))
+
+    return findings
+
+def check_modulo(record):
+    if record.mod_error:
+        return [Finding('ERROR', 'modulo', record.file, f"modError found in file")]
+    return []
+
+def check_duplicates(record):
+    if record.duplicates:
+        return [Finding('WARNING', 'duplicates', record.file, f"Duplicate Variable Names Found: {', '.join(record.duplicates)}")]
+    return [Finding('OK', 'duplicates', record.file, f"No Duplicate Variable Names Found.")]
     
-                    # Append the dictionary to sensors_info
-                    sensors_info.append(sensor_info)
-                    found = True      # don't break out of loop - needed to find duplicates
-                        
-            if not found:
-                if idx == 'latitude' or idx == 'longitude':
-                    print(f"NOTE: Sensor {idx} is not a processed variable")
-                    buffer.write(f"NOTE: Sensor {idx} is not a processed variable<br>")
-                else:
-                    print(f"ERROR: Sensor {idx} variable not output")
-                    buffer.write(f"<strong>ERROR:</strong> Sensor {idx} variable not output<br>")
-                errors_found = True
-                                  
-        # range check the sensors
-        for item in sensors_info:
-            found = False
-            file.seek(0)
-            if item['value'] not in ['c0S/m', 'c1S/m', 'sbeox0V', 'sbeox1V']:
-                pattern = re.compile(r'# span ' + re.escape(item['number']) + r' =\s+(-?\d+(\.\d+)?),\s*(-?\d+(\.\d+)?)')
-                               
-                for line in file:
-                    # Try to match the pattern in the current line
-                    match = pattern.match(line)
-                    if match:
-                        min = match.group(1)
-                        max = match.group(3)                
-                        if float(min) < sensor_limits[item['value']]["min"] or float(max) > sensor_limits[item['value']]["max"]:
-                                print(f"ERROR: Sensor {item['value']} {min} : {max} not within min and max range {sensor_limits[item['value']]}")
-                                buffer.write(f"<strong>ERROR: Sensor {item['value']} {min} : {max} not within min and max range {sensor_limits[item['value']]}</strong><br>")
-                                errors_found = True
-                        found = True        
-                        break
-                        
-                if not found:
-                    print(f"Sensor {item['value']} span range not found")
-                    buffer.write(f"Sensor {item['value']} span range not found<br>")
-                    errors_found = True
-                                        
-
-def review_data(hdr_file_path):
-    global errors_found
+def check_sensor_data(record):
+    findings = []
+
+    for idx in SENSOR_LIMITS:
+        if idx not in record.name_index:
+            if idx == 'latitude' or idx == 'longitude':
+                findings.append(Finding('NOTE', 'sensors', record.file, f"Sensor {idx} is not a processed variable"))
+            else:
+                findings.append(Finding('ERROR', 'sensors', record.file, f"Sensor {idx} variable not output"))
+
+    # range check the sensors, every occurrence of a duplicated sensor is checked
+    for idx in SENSOR_LIMITS:
+        if idx in ['c0S/m', 'c1S/m', 'sbeox0V', 'sbeox1V']:
+            continue
+        for number in record.name_index.get(idx, []):
+            if number in record.spans:
+                min, max = record.spans[number]
+                try:
+                    out_of_range = float(min) < SENSOR_LIMITS[idx]["min"] or float(max) > SENSOR_LIMITS[idx]["max"]
+                except ValueError:
+                    findings.append(Finding('ERROR', 'ranges', record.file, f"Sensor {idx} span {min}, {max} is not numeric"))
+                    continue
+                if out_of_range:
+                    findings.append(Finding('ERROR', 'ranges', record.file, f"Sensor {idx} {min} : {max} not within min and max range {SENSOR_LIMITS[idx]}"))
+            else:
+                findings.append(Finding('ERROR', 'ranges', record.file, f"Sensor {idx} span range not found"))
+
+    return findings
+
+def checks_version():
+    # the sensor limits are part of the version, editing them invalidates the cache
+    return CHECKS_VERSION + ':' + hashlib.sha256(repr(SENSOR_LIMITS).encode()).hexdigest()[:12]
+
+def review_file(file):
+    # Read the header once (up to *END* for .cnv files), all checks use the parsed record.
+    # Returns the header content hash and the findings
+    try:
+        content = read_header_bytes(file)
+    except FileNotFoundError:
+        return None, [Finding('ERROR', 'file', file, f"File not found: {file}")]
+    record = parse_header(content.decode('latin-1').splitlines(), file)
+    findings = []
+    # Check NMEA Lat, Long
+    findings += check_nmea(record)
+    # Check for any duplicate variable names, not just the ones in the sensor_list
+    findings += check_duplicates(record)
+    # Check that sensors are included in .hdr files and perform range checks
+    findings += check_sensor_data(record)
+    # Check for modulo error
+    findings += check_modulo(record)
+    return hashlib.sha256(content).hexdigest(), findings
+
+def open_cache(cache_file):
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    connection = sqlite3.connect(cache_file)
+    connection.execute("""CREATE TABLE IF NOT EXISTS hdr_findings (
+        path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT, version TEXT, findings TEXT)""")
+    return connection
+
+def file_hash(file):
+    # only the header is hashed, the scan data in a .cnv file does not change the findings
+    return hashlib.sha256(read_header_bytes(file)).hexdigest()
+
+def cached_findings(connection, file, version):
+    # Return the stored findings if the file is unchanged: same size and mtime, or (after a touch or copy)
+    # same content hash. Returns None if the file has to be checked
+    row = connection.execute("SELECT size, mtime_ns, sha256, version, findings FROM hdr_findings WHERE path = ?",
+                             (os.path.abspath(file),)).fetchone()
+    if row is None or row[3] != version:
+        return None
+    try:
+        stat = os.stat(file)
+    except FileNotFoundError:
+        return None
+    size, mtime_ns, sha256, _, findings = row
+    if stat.st_size != size:
+        return None
+    if stat.st_mtime_ns != mtime_ns:
+        if file_hash(file) != sha256:
+            return None
+        connection.execute("UPDATE hdr_findings SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, os.path.abspath(file)))
+    # the findings were stored for the path as it was spelled then (cr or ./cr), report them for this path
+    return [Finding(*finding)._replace(file=file) for finding in json.loads(findings)]
+
+def store_findings(connection, file, sha256, findings, version):
+    stat = os.stat(file)
+    connection.execute("INSERT OR REPLACE INTO hdr_findings VALUES (?, ?, ?, ?, ?, ?)",
+                       (os.path.abspath(file), stat.st_size, stat.st_mtime_ns, sha256, version,
+                        json.dumps([list(finding) for finding in findings])))
+
+def format_finding(finding, html=False):
+    if finding.severity == 'ERROR' and html and finding.check == 'ranges':
+        return f"<strong>ERROR: {finding.message}</strong>"
+    if finding.severity == 'ERROR':
+        return f"<strong>ERROR:</strong> {finding.message}" if html else f"ERROR: {finding.message}"
+    if finding.severity == 'NOTE':
+        return f"NOTE: {finding.message}"
+    return finding.message
+
+def summarize_errors(findings):
+    # index the reported findings: (severity, check, message) -> files, in the order they were first found
+    error_files = {}
+    for finding in findings:
+        if finding.severity in REPORTED:
+            files = error_files.setdefault((finding.severity, finding.check, finding.message), [])
+            if finding.file not in files:
+                files.append(finding.file)
+    return error_files
+
+def get_cruise_name(hdr_file_path):
+    match = re.search(r'ship-provided_data_(.*?)[\\/]', hdr_file_path)
+    if match:
+        return match.group(1)
+    return None
+
+def write_report(hdr_file_path, files, findings):
     summary_buffer = StringIO()
     sensor_list = ["prDM", "t090C", "t190C", "c0S/m", "c1S/m", "CStarAt0", "CStarTr0", "flECO-AFL", "pumps", "latitude", "longitude", "sal00", "sal11", "sbeox0V", "sbeox1VL"]
+    errors_found = len(files) == 0 or any(finding.severity in FAILING for finding in findings)
     
     print(f"Checking Processed Header files for sensors and their ranges")
     summary_buffer.write(f"<strong>Checking Processed Header files for sensors and their ranges</strong><br>")    
     print(f"Checking for expected sensor variables: {sensor_list}")
     summary_buffer.write(f"<br>Checking for expected sensor variables: {sensor_list}<br><br>")
 
-    files = find_hdr_files(hdr_file_path)
     if len(files) == 0:
         print(f"There are no header files to check for this cruise.")
         summary_buffer.write(f"There are no header files to check for this cruise.<br>")
-        errors_found = True
-    
+
     for file in files:
         print(f"Checking {file}")
-        buffer.write(f"<strong><br><br>Checking {file}</strong><br>")
-        # Check NMEA Lat, Long
-        check_nmea(file)
-        # Check for any duplicate variable names, not just the ones in the sensor_list
-        check_duplicates(file)
-        # Check that sensors are included in .hdr files and perform range checks
-        check_sensor_data(file)
-        # Check for modulo error
-        check_modulo(file)
-
-   # remove duplicate errors in buffer
-    error_files = summarize_errors()
+        for finding in findings:
+            if finding.file == file:
+                print(format_finding(finding))
+
+    # each error once, with the files it was found in
+    error_files = summarize_errors(findings)
 
     found_in_all = False
-    for error in error_files:
-        if len(files) == len(error_files[error]):
+    for (severity, check, message), error_file_list in error_files.items():
+        error = format_finding(Finding(severity, check, None, message), html=True)
+        if len(files) == len(error_file_list):
             if not found_in_all:
                 summary_buffer.write(f"<u>Found in all header files:</u> <br>")
             summary_buffer.write(f"{error}")
             found_in_all = True
         else:
-            summary_buffer.write(f"<br><u>Errors found in files:</u> {', <br>'.join(error_files[error])}<br>")  #carriage return between filenames
+            summary_buffer.write(f"<br><u>Errors found in files:</u> {', <br>'.join(error_file_list)}<br>")  #carriage return between filenames
             summary_buffer.write(f"{error}")
             found_in_all = False
         summary_buffer.write(f"<br>")
@@ -286,28 +255,66 @@ def review_data(hdr_file_path):
         print(f"ERRORS FOUND!")
         summary_buffer.write(f"<br><br><strong>ERRORS FOUND!</strong><br>")
         
-            
-    match = re.search(r'ship-provided_data_(.*?)\\', hdr_file_path)
-    if match:
-        cruise_name = match.group(1)
-    else:
+    cruise_name = get_cruise_name(hdr_file_path)
+    if cruise_name is None:
         print(f"Cruise name pattern not found in file path.")
         summary_buffer.write(f"Cruise name pattern not found in file path.<br>")
+        cruise_name = os.path.basename(os.path.normpath(hdr_file_path))
 
     buffer_content = summary_buffer.getvalue()
     summary_buffer.close()
     with open(current_dir + "/" + cruise_name +"_ctd_hdr_review_results.html", "w") as file:   # txt files don't support bold font
         file.write(buffer_content)
+
+def review_data(hdr_file_paths, workers=1, cache_file=None):
+    # check the header files of all cruises in one pool, then write one report per cruise
+    if isinstance(hdr_file_paths, str):
+        hdr_file_paths = [hdr_file_paths]
+    cruise_files = {hdr_file_path: find_hdr_files(hdr_file_path) for hdr_file_path in hdr_file_paths}
+    all_files = [file for files in cruise_files.values() for file in files]
+
+    # reuse the findings of files that have not changed since they were last checked
+    results = {}
+    version = checks_version()
+    connection = open_cache(cache_file) if cache_file else None
+    if connection:
+        for file in all_files:
+            findings = cached_findings(connection, file, version)
+            if findings is not None:
+                results[file] = findings
+        print(f"Using cached results for {len(results)} of {len(all_files)} header files")
+    changed_files = [file for file in all_files if file not in results]
+
+    if workers > 1 and len(changed_files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            reviewed = list(executor.map(review_file, changed_files, chunksize=8))
+    else:
+        reviewed = [review_file(file) for file in changed_files]
+
+    for file, (sha256, findings) in zip(changed_files, reviewed):
+        results[file] = findings
+        if connection and sha256 is not None:
+            store_findings(connection, file, sha256, findings, version)
+    if connection:
+        connection.commit()
+        connection.close()
+
+    for hdr_file_path, files in cruise_files.items():
+        findings = [finding for file in files for finding in results[file]]
+        write_report(hdr_file_path, files, findings)
     
 
 def main():
     # If paths are on Google Docs, you must download the files to your local pc file system.
     parser = argparse.ArgumentParser(description='Review CTD header data prior to upload to RDS for NES-LTER REST API.')
-    parser.add_argument('path', type=str, help='Path to CTD processed header directory')
+    parser.add_argument('path', type=str, nargs='+', help='Path to CTD processed header (.hdr or .cnv) directory (one or more cruises)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes used to check the header files (default: number of cpus)')
+    parser.add_argument('--cache', type=str, default=CACHE_FILE, help=f'SQLite file with the findings of previously checked header files (default: {CACHE_FILE})')
+    parser.add_argument('--no-cache', action='store_true', help='Check every header file again and do not update the cache')
     
     args = parser.parse_args()
     
-    review_data(args.path)
+    review_data(args.path, args.workers, None if args.no_cache else args.cache)
 
 if __name__ == '__main__':
     main()
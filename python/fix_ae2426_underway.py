@@ -1,24 +1,96 @@
 # Removes the column name prefix from each record in the Atlantic Explorer Underway files
+# i.e. "SST:18.52" -> "18.52". Files are rewritten line by line (in parallel across files) and
+# --dry-run reports the column names found in the prefixes without changing anything.
 import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 import os
-import pandas as pd
 import re
+from underway_utils import replace_file
 
-def clean_data(path):
+# everything up to the last ':' of each comma separated value is the column name prefix
+PREFIX = re.compile(r'[^,\r\n]*:')
+# the column name is the text before the first ':' of a value
+NAME = re.compile(r'^([^:]*):')
+INT = re.compile(r'^[+-]?\d+$')
+FLOAT = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+
+def value_type(value):
+    if value == '':
+        return None
+    if INT.match(value):
+        return 'int'
+    if FLOAT.match(value):
+        return 'float'
+    return 'text'
+
+def read_schema(file):
+    # column position -> Counter of prefix names and Counter of value types
+    names = {}
+    types = {}
+    with open(file, 'r', encoding='utf-8', newline='') as f:
+        for line in f:
+            for position, value in enumerate(line.rstrip('\r\n').split(',')):
+                match = NAME.match(value)
+                names.setdefault(position, Counter())[match.group(1) if match else ''] += 1
+                value = value.rsplit(':', 1)[-1].strip()
+                types.setdefault(position, Counter())[value_type(value)] += 1
+    return names, types
+
+def column_names(names):
+    # the most common prefix in each column position
+    return [names[position].most_common(1)[0][0] for position in sorted(names)]
+
+def clean_file(file, header=False):
+    # strip the prefixes one line at a time and replace the file when done
+    names = read_schema(file)[0] if header else None
+    with open(file, 'r', encoding='utf-8', newline='') as source, replace_file(file, encoding='utf-8', newline='') as output:
+        lines = 0
+        for line in source:
+            if header and lines == 0:
+                output.write(','.join(column_names(names)) + line[len(line.rstrip('\r\n')):])
+            output.write(PREFIX.sub('', line))
+            lines += 1
+    return file, lines
+
+def print_schema(file):
+    names, types = read_schema(file)
+    print(f"{file}:")
+    for position in sorted(names):
+        name = names[position].most_common(1)[0][0]
+        value_types = [t for t in types[position] if t is not None]
+        column_type = 'text' if 'text' in value_types else 'float' if 'float' in value_types else 'int' if value_types else 'empty'
+        other_names = [n for n in names[position] if n != name]
+        note = f" (also named {', '.join(other_names)})" if other_names else ''
+        print(f"    {position}: {name} {column_type}{note}")
+
+def clean_data(path, workers=1, header=False, dry_run=False):
     # read in the 1 minute SAMOS csv files
     print("Path:", path)
-    for file in glob(os.path.join(path, '*.csv')):
-        data = pd.read_csv(file, delimiter=',', header=None) # Specify header=None to treat all rows as data
-        data = data.map(lambda x: re.sub(r'.*?:', '', str(x)))
-        data.to_csv(file, index=False, header=False)
+    files = sorted(glob(os.path.join(path, '*.csv')))
+    if dry_run:
+        for file in files:
+            print_schema(file)
+        return
+
+    if workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            cleaned = list(executor.map(clean_file, files, [header] * len(files)))
+    else:
+        cleaned = [clean_file(file, header) for file in files]
+    for file, lines in cleaned:
+        print(f"Cleaned {file}: {lines} lines")
 
 def main():
     parser = argparse.ArgumentParser(description='Fix Atlantic Explorer Underway Cruise Data for REST API.')
     parser.add_argument('path', type=str, help='Path to underway data files')
+    parser.add_argument('--workers', type=int, default=1, help='Number of files cleaned in parallel (default: 1)')
+    parser.add_argument('--header', action='store_true', help='Write the column names found in the prefixes as a header line')
+    parser.add_argument('--dry-run', action='store_true', help='Only report the column names and value types found in the prefixes')
 
     args = parser.parse_args()
-    clean_data(args.path)
+    clean_data(args.path, args.workers, args.header, args.dry_run)
 
 if __name__ == '__main__':
     main()
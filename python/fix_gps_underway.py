@@ -1,175 +1,150 @@
 # This Python Script fills in missing Cruise Underway GPS lat, long entries in the 1 minute .csv processed files by obtaining the correct entries from 
 # the Underway GPS files in the same directory.
 # This script also fills in the salinity, temp, fluorometer, and flow rate if they are missing. These values are obtained from SSW files.
+# With --store the GPS and SSW values are read from the gps and ssw datasets of an underway_store.py Parquet store
+# (underway_store.py --one-second) instead of the files.
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 import os
 from io import StringIO
 import re
 import pandas as pd
 buffer = StringIO()
-from datetime import datetime
-import math
+from underway_utils import is_missing, load_time_index, fill_nearest_time, read_dslog_csv, write_dslog_csv, dslog_times
+import underway_store
 
-current_dir = os.getcwd()
-
-def find_gps_file(url, min_file):
-    matching_file = ''
-    pattern = r'[a-zA-Z]+(\d{6})_\d+\.csv'
-    match = re.search(pattern, min_file)
-    # extract date from 1min file name
-    extracted_value = match.group(1)
-    
-    gps_regex_pattern = rf'.*GPS(\d+)_{re.escape(extracted_value)}_\d{{4}}\.csv'
-
-    # Iterate through files in the directory
-    for filename in os.listdir(url):
-        if re.match(gps_regex_pattern, filename):
-            matching_file = (os.path.join(url + '\\', filename))
-
-    return matching_file
-
-def find_ssw_file(url, min_file):
-    matching_file = ''
-    pattern = r'[a-zA-Z]+(\d{6})_\d+\.csv'
-    match = re.search(pattern, min_file)
-    # extract date from 1min file name
-    extracted_value = match.group(1)
-    
-    gps_regex_pattern = rf'.*SSW(\d+)_{re.escape(extracted_value)}_\d{{4}}\.csv'
-
-    # Iterate through files in the directory
-    for filename in os.listdir(url):
-        if re.match(gps_regex_pattern, filename):
-            matching_file = (os.path.join(url + '\\', filename))
+# 1 min Underway column -> GPS / SSW file column
+GPS_COLUMNS = {' Dec_LAT': ' DPS112_LAT', ' Dec_LON': ' DPS112_LON'}
+SSW_COLUMNS = {' SBE45S': ' SBE45S', ' SBE48T': ' SBE48T', ' FLR': ' FLR', ' FLOW': ' FLOW'}
 
-    return matching_file
+current_dir = os.getcwd()
 
-def find_1min_files(url):
+def find_underway_files(url):
+    # Scan the directory once and pair each 1 min file (i.e. AR211028_0000.csv) with the GPS and
+    # Science SeaWater (SSW) files for the same date. Returns a sorted list of (1 min file, gps file, ssw file)
     matching_files = []
     if not os.path.exists(url):
         print(f"Directory '{url}' does not exist.")
         return matching_files
 
-    # Compile a regex pattern for matching files
-    pattern = r'^[a-zA-Z]+\d+_\d{4}\.csv$'
-    regex_pattern = re.compile(pattern)
-
-    # Iterate through files in the directory
-    for filename in os.listdir(url):
-        if regex_pattern.match(filename):
-            matching_files.append(os.path.join(filename))
+    min_pattern = re.compile(r'^[a-zA-Z]+(\d{6})\d*_\d{4}\.csv$')
+    gps_pattern = re.compile(r'.*GPS\d+_(\d{6})_\d{4}\.csv')
+    ssw_pattern = re.compile(r'.*SSW\d+_(\d{6})_\d{4}\.csv')
+
+    min_files = []
+    gps_files = {}
+    ssw_files = {}
+    # sorted so that the last matching GPS/SSW file for a date is picked consistently
+    for filename in sorted(os.listdir(url)):
+        match = min_pattern.match(filename)
+        if match:
+            min_files.append((filename, match.group(1)))
+        match = gps_pattern.match(filename)
+        if match:
+            gps_files[match.group(1)] = os.path.join(url, filename)
+        match = ssw_pattern.match(filename)
+        if match:
+            ssw_files[match.group(1)] = os.path.join(url, filename)
+
+    for filename, date in min_files:
+        matching_files.append((filename, gps_files.get(date, ''), ssw_files.get(date, '')))
 
     return matching_files
 
-def find_row_by_time(file, time_gmt, invalid_time_strings):
-    df = pd.read_csv(file, delimiter=',', header = 1)  # second row is header row)
-
-    # Strip leading and trailing whitespaces from the target time string
-    time_gmt_str = time_gmt.strip()
-    target_time = datetime.strptime(time_gmt_str, '%H:%M:%S.%f')
-    
-    # Calculate the time difference for each row
-    def calculate_time_difference(x):
-        try:
-            time_value = datetime.strptime(x.strip(), '%H:%M:%S.%f')
-            return abs((target_time - time_value).total_seconds())
-        except:
-            # Handle the case where the time data is invalid
-            if (x, file) not in invalid_time_strings:
-                invalid_time_strings.append((x, file))
-            return float('inf')  # Set a default value
-
-    df['TIME_DIFF'] = df[' TIME_GMT'].apply(calculate_time_difference)
-
-    # Find the row with the minimum time difference, excluding NaN values
-    nearest_row = df.loc[df['TIME_DIFF'].idxmin()]
-    
-    return nearest_row
-
-def fix_gps(file_path):
-    invalid_time_strings = []
+def fix_file(file_path, file, gps_file, ssw_file, tolerance=None, report=False, cache=True, store=None):
+    print(f"Fixing {file}")
+    source = read_dslog_csv(os.path.join(file_path,file))
+    df1 = source.data
+
+    df_modified = df1.copy()
+    reports = []
+
+    # rows with NAN lat or lon are filled from the nearest time in the gps file
+    gps_rows = is_missing(df1[' Dec_LAT']) | is_missing(df1[' Dec_LON'])   #note space in column header name and NAN value
+    # rows with missing salinity, temp, fluorometer, or flow rate are filled from the nearest time in the Science SeaWater (SSW) file
+    ssw_rows = is_missing(df1[' SBE45S']) | is_missing(df1[' SBE48T']) | is_missing(df1[' FLR']) | is_missing(df1[' FLOW'])
+
+    for rows, source_file, column_map, name in [(gps_rows, gps_file, GPS_COLUMNS, 'GPS'),
+                                                (ssw_rows, ssw_file, SSW_COLUMNS, 'SSW')]:
+        if not rows.any():
+            continue
+        if store:
+            times = dslog_times(df1).dropna()
+            if len(times) == 0:
+                print(f"ERROR: No valid DATE_GMT, TIME_GMT in {file}. Cannot fix Underway file.")
+                continue
+            index = underway_store.load_time_index(store, name.lower(), times.iloc[0], column_map.values())
+        elif source_file == '':
+            print(f"ERROR: No {name} file found for {file}. Cannot fix Underway file.")
+            continue
+        else:
+            index = load_time_index(source_file, column_map.values(), cache)
+        for time_string in index.invalid_times:
+            print(f"Invalid time string '{time_string}' in {source_file}")
+        fill_report, unmatched = fill_nearest_time(df_modified, index, column_map, rows, tolerance)
+        if unmatched:
+            print(f"ERROR: {len(unmatched)} rows have no {name} sample within {tolerance} seconds. Cannot fix Underway file at those times.")
+        if len(fill_report) > 0:
+            print(f"Filled {len(fill_report)} values from {name} file, max time offset {fill_report['OFFSET_SECONDS'].abs().max():.3f} seconds")
+        reports.append(fill_report)
+
+    nan_found = any(len(fill_report) > 0 for fill_report in reports)
+    if nan_found:
+        # Write the modified DataFrame with the original first line to a new file 
+        base_filename, extension = os.path.splitext(file)
+        output_filename = f"{base_filename}_new{extension}"
+        write_dslog_csv(os.path.join(file_path,output_filename), source._replace(data=df_modified))
+
+        if report:
+            # how far away (in time) each filled value was taken from
+            report_filename = f"{base_filename}_fill_report.csv"
+            pd.concat(reports, ignore_index=True).to_csv(os.path.join(file_path,report_filename), index=False)
+
+def fix_file_safely(args):
+    # a day that cannot be fixed is reported and the other days are still fixed
+    try:
+        fix_file(*args)
+    except Exception as e:
+        print(f"ERROR: Could not fix {args[1]}: {e}")
+
+def fix_file_logged(args):
+    # run fix_file in a worker process and return its log output so the parent can print it in file order
+    with redirect_stdout(StringIO()) as log:
+        fix_file_safely(args)
+    return log.getvalue()
+
+def fix_gps(file_path, tolerance=None, report=False, cache=True, workers=1, store=None):
     print(f"Fixing GPS in 1 min .csv Underway files")    
 
-    files = find_1min_files(file_path)
+    files = find_underway_files(file_path)
     if len(files) == 0:
         print(f"There are no 1 min files to check for this cruise.")
-    
-    for file in files:
-        nan_found = False
-        print(f"Fixing {file}")
-        df1 = pd.read_csv(os.path.join(file_path,file), header = 1)  # second row is header row
-
-        # find corresponding GPS file
-        gps_file = find_gps_file(file_path, file)
-            
-        # find corresponding Science SeaWater (SSW) file
-        ssw_file = find_ssw_file(file_path, file)
-            
-        df_modified = df1.copy()
-        
-        for index, row in df1.iloc[:].iterrows():
-            time_gmt = row[' TIME_GMT']
-            
-            if row[' Dec_LAT'] == ' NAN' or row[' Dec_LON'] == ' NAN':   #note space in column header name and NAN value
-                #find row by nearest time in gps file
-                nearest_row = find_row_by_time(gps_file, time_gmt, invalid_time_strings)
-                if nearest_row[' DPS112_LAT'] == ' NAN' or nearest_row[' DPS112_LON'] == ' NAN':
-                    print(f"ERROR: GPS file lat, lon values are NAN. Cannot fix Underway file.")
-                else:
-                    df_modified.at[index, ' Dec_LAT'] = nearest_row[' DPS112_LAT']
-                    df_modified.at[index, ' Dec_LON'] = nearest_row[' DPS112_LON']
-                    nan_found = True
-                    
-            if math.isnan(row[' SBE45S']) or math.isnan(row[' SBE48T']) or math.isnan(row[' FLR']) or math.isnan(row[' FLOW']):
-                #find row by nearest time in ssw file
-                nearest_row = find_row_by_time(ssw_file, time_gmt, invalid_time_strings)
-                #get salinity, temp, fluorometer, and flow rate in ssw file 
-                if nearest_row[' SBE45S'] == '':
-                    print(f"ERROR: SSW File salinity value is NAN. Cannot fix Underway file.")
-                else:
-                    df_modified.at[index, ' SBE45S'] = nearest_row[' SBE45S']
-                    nan_found = True
-                if  nearest_row[' SBE48T'] == '':   
-                    print(f"ERROR: SSW File temperature value is NAN. Cannot fix Underway file.")
-                else:
-                    df_modified.at[index, ' SBE48T'] = nearest_row[' SBE48T']
-                    nan_found = True
-                if nearest_row[' FLR'] == '':
-                    print(f"ERROR: SSW File fluormeter value is NAN. Cannot fix Underway file.")
-                else:
-                    df_modified.at[index, ' FLR'] = nearest_row[' FLR']
-                    nan_found = True
-                if nearest_row[' FLOW'] == '':
-                    print(f"ERROR: SSW File flow rate value is NAN. Cannot fix Underway file.")
-                else:
-                    df_modified.at[index, ' FLOW'] = nearest_row[' FLOW']
-                    nan_found = True
-        
-        if nan_found:
-            # Write the modified DataFrame to a new file 
-            base_filename, extension = os.path.splitext(file)
-            output_filename = f"{base_filename}_new{extension}"
-            df_modified.to_csv(os.path.join(file_path,output_filename), index=False)
-        
-            # Read the first line of the source CSV file as text ('WHOI SSSG dsLogCsv' does not conform to df with columns)
-            first_line_df = pd.read_csv(os.path.join(file_path,file), nrows=1, header=None)
-            # Create a sample DataFrame representing the rest of the data in the modified file
-            rest_of_data_df = pd.read_csv(os.path.join(file_path,output_filename), header=None)
-            # Concatenate the first line with the rest of the data
-            result_df = pd.concat([first_line_df, rest_of_data_df], ignore_index=True)
-
-            # Write the result DataFrame to a new CSV file
-            result_df.to_csv(os.path.join(file_path,output_filename), index=False, header=False)    
+
+    tasks = [(file_path, file, gps_file, ssw_file, tolerance, report, cache, store) for file, gps_file, ssw_file in files]
+    if workers > 1:
+        # each day is independent, repair them in parallel and print the logs in file order
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for log in executor.map(fix_file_logged, tasks):
+                print(log, end='')
+    else:
+        for task in tasks:
+            fix_file_safely(task)
 
 def main():
     # If paths are on Google Docs, you must download the files to your local pc file system.
     parser = argparse.ArgumentParser(description='Fix GPS on 1 min Underway files (i.e. AR211028_0000.csv).')
     parser.add_argument('path', type=str, help='Path to Underway files in the proc directory')
+    parser.add_argument('--tolerance', type=float, default=None, help='Maximum time offset in seconds of a GPS/SSW sample used to fill a value (default: nearest sample at any offset)')
+    parser.add_argument('--report', action='store_true', help='Write a _fill_report.csv with the time offset of every filled value')
+    parser.add_argument('--no-cache', action='store_true', help='Re-parse the GPS/SSW files instead of using the cached time index in .underway_index')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes used to fix the daily files in parallel (default: 1)')
+    parser.add_argument('--store', type=str, default=None, help='Read the GPS/SSW values from this underway_store.py Parquet store (ingested with --one-second) instead of the GPS/SSW files')
     
     args = parser.parse_args()
     
-    fix_gps(args.path)
+    fix_gps(args.path, args.tolerance, args.report, not args.no_cache, args.workers, args.store)
 
 if __name__ == '__main__':
     main()
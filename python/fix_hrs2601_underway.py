@@ -8,38 +8,24 @@ buffer = StringIO()
 from glob import glob
 import datetime as datetime
 from pathlib import Path
+from underway_utils import read_par_files, merge_par
 
 DATE = 'date'
 current_dir = os.getcwd()
 
-def fix_underway(file_path):
+def fix_underway(file_path, par_tolerance=30):
     print(f"Fixing Underway file")    
     # read in the hrs2601 underway file
     file_path = Path(file_path)
     df = pd.read_csv(file_path / "hrs2601_underway_noMet_noPAR.csv")
 
-    # read in and concatenate the PAR files
-    pfs = []
+    # read in and concatenate the Time and PAR sensor columns of the PAR files, with an ISO 8601 datetime column
+    pdf = read_par_files(glob(os.path.join(file_path, "Light Logger (PAR)", "BSI2026*.csv")), skiprows=8)
 
-    for file in glob(os.path.join(file_path, "Light Logger (PAR)", "BSI2026*.csv")):
-        data = pd.read_csv(file, delimiter=",", skiprows=8, encoding="cp1252")
-        pfs.append(data)
-
-    pdf = pd.concat(pfs, ignore_index=True)
-
-    # create an ISO 8601 datetime column
-    date_obj = pd.to_datetime(
-        pdf["Time"],
-        errors="coerce",
-        utc=True
-    )
-
-    pdf.insert(1, DATE, date_obj)
-
-    # Merge "QSR - S/N 10367" underway data from the Light Logger Par data files based on time
+    # Merge "QSR - S/N 10367" underway data from the Light Logger Par data files based on nearest time
     # into new column in the resulting dataFrame
     df['date'] = pd.to_datetime(df['date'], utc=True, errors='coerce')
-    df = df.merge(pdf[['date', 'QSR - S/N 10367']], on='date', how='left')
+    df = merge_par(df, pdf, tolerance=par_tolerance)
 
     # write dataframe to underway file
     df.to_csv('hrs2601_underway.csv', index=False)
@@ -50,9 +36,11 @@ def main():
     parser = argparse.ArgumentParser(description='Fix Underway file.')
     parser.add_argument('path', type=str, help='Path to Underway file in the CTD directory')
     
+    parser.add_argument('--par-tolerance', type=float, default=30, help='Maximum time difference in seconds between a row and the PAR value merged into it (default: 30)')
+    
     args = parser.parse_args()
     
-    fix_underway(args.path)
+    fix_underway(args.path, args.par_tolerance)
 
 if __name__ == '__main__':
     main()
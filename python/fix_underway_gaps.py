@@ -0,0 +1,117 @@
+# This Python Script repairs gaps and duplicate rows in the 1 minute (or 1 second) Underway .csv processed files.
+# The repairs for a cruise are listed in a rule file (default: underway_gap_rules.csv in the Underway directory),
+# one line per file to fix:
+#     file,truncate_after,fragments,cadence,nan_columns
+#     AR221120_0000.csv,14:51:00.800,AR221120_1931.csv,1min,Dec_LAT;Dec_LON
+# file            - Underway file to fix
+# truncate_after  - (optional) delete erroneous rows after this TIME_GMT
+# fragments       - (optional) files to splice in, separated by ';' (i.e. AR221120_1931.csv, this file should not exist)
+# cadence         - (optional) time between rows, default 1min (use 1s for 1 second files)
+# nan_columns     - (optional) columns set to NAN in the added rows, separated by ';', other cells are left empty
+# Missing rows are added with NAN values (in every column unless nan_columns is given) and the result is
+# written to a _new.csv file.
+# After this script runs, run fix_gps_underway.py to populate lat, lon from the gps file
+
+import argparse
+import os
+import re
+import numpy as np
+import pandas as pd
+from underway_utils import TIME_GMT, read_dslog_csv, write_dslog_csv, dslog_times, find_gaps, synthesize_rows
+
+DEFAULT_CADENCE = '1min'
+
+def read_rules(rules_file):
+    rules = pd.read_csv(rules_file, dtype=str, keep_default_na=False, comment='#', skipinitialspace=True)
+    return rules.to_dict('records')
+
+def print_gaps(gaps, action, max_listed=20):
+    if len(gaps) > max_listed:
+        print(f"{action} {gaps['missing'].sum()} missing rows in {len(gaps)} gaps")
+    else:
+        for gap in gaps.itertuples():
+            print(f"{action} {gap.missing} missing rows between {gap.start:%H:%M:%S} and {gap.end:%H:%M:%S}")
+
+def fix_gaps(file_path, rule):
+    file = rule['file']
+    cadence = rule.get('cadence', '').strip() or DEFAULT_CADENCE
+    print(f"Fixing {file}")
+    source = read_dslog_csv(os.path.join(file_path,file))
+    df = source.data
+
+    truncate_after = rule.get('truncate_after', '').strip()
+    if truncate_after:
+        # Keep only the rows up to the first row with this TIME_GMT
+        index_to_keep = np.flatnonzero(df[TIME_GMT].str.strip() == truncate_after)
+        if len(index_to_keep) == 0:
+            print(f"ERROR: TIME_GMT {truncate_after} not found in {file}. Cannot fix Underway file.")
+            return
+        print(f"Deleting {len(df) - index_to_keep[0] - 1} rows after {truncate_after}")
+        df = df.iloc[:index_to_keep[0] + 1]
+
+    frames = [df]
+    for fragment in filter(None, (name.strip() for name in rule.get('fragments', '').split(';'))):
+        fragment_df = read_dslog_csv(os.path.join(file_path,fragment)).data
+        print(f"Adding {len(fragment_df)} rows from {fragment}")
+        frames.append(fragment_df)
+    df = pd.concat(frames, ignore_index=True)
+
+    times = dslog_times(df)
+    if times.isna().any():
+        print(f"Deleting {times.isna().sum()} rows with invalid DATE_GMT or TIME_GMT")
+        df = df[times.notna()]
+        times = times[times.notna()]
+    order = np.argsort(times.to_numpy(), kind='stable')
+    df = df.iloc[order].reset_index(drop=True)
+    times = times.iloc[order].reset_index(drop=True)
+
+    gaps, duplicates = find_gaps(times, cadence)
+    if duplicates.any():
+        print(f"Deleting {duplicates.sum()} duplicate rows")
+        df = df[~duplicates]
+        times = times[~duplicates]
+    print_gaps(gaps, 'Adding')
+
+    if len(gaps) > 0:
+        nan_columns = [name.strip() for name in rule.get('nan_columns', '').split(';') if name.strip()]
+        new_rows, new_times = synthesize_rows(df, times, gaps, cadence, nan_columns=nan_columns or None)
+        times = pd.concat([times, new_times], ignore_index=True)
+        df = pd.concat([df, new_rows], ignore_index=True)
+        order = np.argsort(times.to_numpy(), kind='stable')
+        df = df.iloc[order]
+
+    # Write the modified DataFrame with the first line of the source file to a new file
+    base_filename, extension = os.path.splitext(file)
+    output_filename = f"{base_filename}_new{extension}"
+    write_dslog_csv(os.path.join(file_path,output_filename), source._replace(data=df.reset_index(drop=True)))
+
+def check_gaps(file_path, cadence=DEFAULT_CADENCE):
+    # report gaps and duplicates in every Underway file without changing anything
+    pattern = re.compile(r'^[a-zA-Z]+\d+_\d{4}\.csv$')
+    for filename in sorted(os.listdir(file_path)):
+        if pattern.match(filename):
+            times = dslog_times(read_dslog_csv(os.path.join(file_path,filename)).data).dropna().sort_values()
+            gaps, duplicates = find_gaps(times.reset_index(drop=True), cadence)
+            if len(gaps) > 0 or duplicates.any():
+                print(f"{filename}: {duplicates.sum()} duplicate rows")
+                print_gaps(gaps, '    Missing')
+
+def main():
+    # If paths are on Google Docs, you must download the files to your local pc file system.
+    parser = argparse.ArgumentParser(description='Fix gaps and duplicate rows in Underway files (i.e. AR221120_0000.csv).')
+    parser.add_argument('path', type=str, help='Path to Underway files in the proc directory')
+    parser.add_argument('--rules', type=str, default=None, help='Rule file listing the files to fix (default: underway_gap_rules.csv in path)')
+    parser.add_argument('--check', action='store_true', help='Only report gaps and duplicate rows in all Underway files')
+    parser.add_argument('--cadence', type=str, default=DEFAULT_CADENCE, help='Time between rows for --check (default: 1min)')
+
+    args = parser.parse_args()
+
+    if args.check:
+        check_gaps(args.path, args.cadence)
+    else:
+        rules_file = args.rules or os.path.join(args.path, 'underway_gap_rules.csv')
+        for rule in read_rules(rules_file):
+            fix_gaps(args.path, rule)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# Numbers and dates of a PDF calibration sheet, tokenized once per document so that each calibration value and
+# date check is a set lookup instead of a substring search of the whole text.
+# Numbers are kept by the number of significant digits they are printed with (trailing zeros count), so
+# 4.33000000e-003 in an XMLCON matches 4.33e-03, 0.00433 or 4.3300e-3 in the PDF, but not 4.331e-3.
+# Dates in any of the formats used on the calibration sheets are kept as datetime.date values.
+
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+import re
+
+# a PDF number printed with fewer significant digits than this does not match a more precise value
+MIN_SIGNIFICANT_DIGITS = 4
+
+NUMBER = re.compile(r'(?<![\w.])[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+DATE_PATTERNS = [
+    re.compile(r'\b\d{1,2}[- ][A-Za-z]{3,9}\.?[- ,]+\d{2,4}\b'),       # 03-Feb-23, 3 February 2023
+    re.compile(r'\b[A-Za-z]{3,9}\.? \d{1,2},? \d{4}\b'),               # February 3, 2023
+    re.compile(r'\b\d{1,2}/\d{1,2}/\d{2,4}\b'),                        # 2/3/2023
+    re.compile(r'\b\d{4}-(?:\d{1,2}|[A-Za-z]{3})-\d{1,2}\b'),          # 2023-02-03, 2023-Feb-03
+    re.compile(r'\b\d{8}\b'),                                          # 20230203
+]
+DATE_FORMATS = ["%d-%b-%y", "%d-%b-%Y", "%d-%B-%y", "%d-%B-%Y", "%d %b %Y", "%d %B %Y", "%d %b, %Y", "%d %B, %Y",
+                "%B %d, %Y", "%b %d, %Y", "%B %d %Y", "%b %d %Y", "%b. %d, %Y",
+                "%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d", "%Y-%b-%d", "%Y%m%d"]
+
+# numbers: significant digits -> set of values rounded to that many digits, dates: set of datetime.date
+PdfTokens = namedtuple('PdfTokens', ['numbers', 'dates'])
+
+def significant_digits(text, keep_trailing_zeros=True):
+    mantissa = re.split(r'[eE]', text.lstrip('+-'))[0].replace('.', '').lstrip('0')
+    if not keep_trailing_zeros:
+        mantissa = mantissa.rstrip('0')
+    return max(len(mantissa), 1)
+
+def round_significant(value, digits):
+    return float(f"{value:.{digits - 1}e}")
+
+def parse_date(text):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+@lru_cache(maxsize=256)
+def pdf_tokens(text):
+    numbers = {}
+    for token in NUMBER.findall(text):
+        digits = significant_digits(token)
+        numbers.setdefault(digits, set()).add(round_significant(float(token), digits))
+    dates = set()
+    for pattern in DATE_PATTERNS:
+        for token in pattern.findall(text):
+            date = parse_date(token)
+            if date:
+                dates.add(date)
+    return PdfTokens(numbers, frozenset(dates))
+
+def has_number(text, value_text):
+    # True if the number value_text (i.e. from an XMLCON) is printed in the PDF text
+    try:
+        value = float(value_text)
+    except (TypeError, ValueError):
+        return False
+    value_digits = significant_digits(value_text.strip(), keep_trailing_zeros=False)
+    for digits, values in pdf_tokens(text).numbers.items():
+        if digits >= min(value_digits, MIN_SIGNIFICANT_DIGITS) and round_significant(value, digits) in values:
+            return True
+    return False
+
+def has_date(text, date):
+    return date in pdf_tokens(text).dates
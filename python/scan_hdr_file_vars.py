@@ -1,9 +1,22 @@
+# Inventory of the variables in SeaBird CTD header files across an archive of cruises.
+# Prints name,description,unit,file_count as CSV. With --output, also writes <output>.csv with the cruises of
+# each variable and <output>.sqlite with one row per cast, so that lookups do not need a rescan of the archive:
+#     python scan_hdr_file_vars.py archive --output inventory
+#     python scan_hdr_file_vars.py --query sbeox0Mm/Kg --output inventory
+
 import os
 import re
+import sys
 import argparse
+import csv
+import sqlite3
 from collections import namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from seabird_header import HEADER_EXTENSIONS, prefer_header_files, read_header_lines
 
 Variable = namedtuple('Variable', ['name', 'description', 'unit'])
+# cruise: ship-provided_data_ name, or the first directory below the scanned directory, cast: file name without extension
+Cast = namedtuple('Cast', ['cruise', 'cast', 'file'])
 
 def parse_variable_line(line):
     # Regular expression to match the variable line pattern
@@ -15,37 +28,128 @@ def parse_variable_line(line):
         return Variable(name.strip(), description.strip(), unit.strip())
     return None
 
-def process_header_file(file_path, variable_counts):
-    used_in_this_file = set()
+def process_header_file(file_path):
+    # Return the variables of one file in file order, each listed once, and an error message or None
+    used_in_this_file = []
     try:
-        with open(file_path, 'r', encoding='latin-1') as file:
-            for line in file:
-                if line.startswith('# name'):
-                    variable = parse_variable_line(line)
-                    if variable and not variable in used_in_this_file:
-                        variable_counts[variable] += 1
-                        used_in_this_file.add(variable)
+        # only the header is read, reading a .cnv file stops at *END*
+        for line in read_header_lines(file_path):
+            if line.startswith('# name'):
+                variable = parse_variable_line(line)
+                if variable and not variable in used_in_this_file:
+                    used_in_this_file.append(variable)
     except Exception as e:
-        print(f"Error processing file {file_path}: {e}")
+        return file_path, used_in_this_file, f"Error processing file {file_path}: {e}"
+    return file_path, used_in_this_file, None
+
+def find_header_files(directory, extensions=('.hdr',)):
+    # os.scandir returns the file type with the directory entry, so no stat call is needed per file
+    # a cast with several header files (i.e. .hdr and .cnv) is counted once, using the first extension listed
+    header_files = []
+    directories = [directory]
+    while directories:
+        files = []
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry.path)
+        header_files.extend(prefer_header_files(files, extensions))
+    return sorted(header_files)
+
+def get_cast(directory, file_path):
+    match = re.search(r'ship-provided_data_(.*?)[\\/]', file_path)
+    if match:
+        cruise = match.group(1)
+    else:
+        relative_path = os.path.relpath(file_path, directory)
+        cruise = relative_path.split(os.sep)[0] if os.sep in relative_path else os.path.basename(os.path.abspath(directory))
+    return Cast(cruise, os.path.splitext(os.path.basename(file_path))[0], file_path)
 
-def scan_directory(directory):
+def scan_directory(directory, extensions=('.hdr',), workers=1):
+    # Return variable -> file count and variable -> list of casts. Files are parsed in worker processes,
+    # results come back in file order and are merged here
     variable_counts = defaultdict(int)
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith('.hdr'):
-                file_path = os.path.join(root, file)
-                process_header_file(file_path, variable_counts)
-    return variable_counts
+    variable_casts = defaultdict(list)
+    files = find_header_files(directory, extensions)
+    if workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(process_header_file, files, chunksize=64))
+    else:
+        results = map(process_header_file, files)
+    for file_path, variables, error in results:
+        if error:
+            print(error)
+        cast = get_cast(directory, file_path)
+        for variable in variables:
+            variable_counts[variable] += 1
+            variable_casts[variable].append(cast)
+    return variable_counts, variable_casts
+
+def write_inventory(output, variable_counts, variable_casts):
+    with open(output + '.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'description', 'unit', 'file_count', 'cruise_count', 'cruises'])
+        for variable, count in variable_counts.items():
+            cruises = sorted(set(cast.cruise for cast in variable_casts[variable]))
+            writer.writerow([*variable, count, len(cruises), ';'.join(cruises)])
+
+    if os.path.exists(output + '.sqlite'):
+        os.remove(output + '.sqlite')
+    connection = sqlite3.connect(output + '.sqlite')
+    with connection:
+        connection.execute("CREATE TABLE variables (id INTEGER PRIMARY KEY, name TEXT, description TEXT, unit TEXT, file_count INTEGER)")
+        connection.execute("CREATE TABLE casts (variable_id INTEGER, cruise TEXT, cast TEXT, file TEXT)")
+        for variable_id, (variable, count) in enumerate(variable_counts.items()):
+            connection.execute("INSERT INTO variables VALUES (?, ?, ?, ?, ?)", (variable_id, *variable, count))
+            connection.executemany("INSERT INTO casts VALUES (?, ?, ?, ?)",
+                                   ((variable_id, *cast) for cast in variable_casts[variable]))
+        connection.execute("CREATE INDEX variables_name ON variables (name)")
+        connection.execute("CREATE INDEX casts_variable ON casts (variable_id)")
+        connection.execute("CREATE INDEX casts_cruise ON casts (cruise)")
+    connection.close()
+    print(f"Wrote {output}.csv and {output}.sqlite")
+
+def query_inventory(output, name):
+    # Return (cruise, cast, file, description, unit) of the casts that use a variable
+    connection = sqlite3.connect(output + '.sqlite')
+    rows = connection.execute("""SELECT casts.cruise, casts.cast, casts.file, variables.description, variables.unit
+        FROM variables JOIN casts ON casts.variable_id = variables.id
+        WHERE variables.name = ? ORDER BY casts.cruise, casts.cast""", (name,)).fetchall()
+    connection.close()
+    return rows
 
 def main():
     parser = argparse.ArgumentParser(description='Parse SeaBird CTD header files for variables.')
-    parser.add_argument('directory', help='Directory path containing .hdr files to scan')
+    parser.add_argument('directory', nargs='?', help='Directory path containing .hdr files to scan')
+    parser.add_argument('--extensions', nargs='+', default=['hdr'], choices=[extension[1:] for extension in HEADER_EXTENSIONS],
+                        help='Header file types to scan, in order of preference (default: hdr)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of files parsed in parallel (default: number of CPUs)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write the inventory to OUTPUT.csv and OUTPUT.sqlite (casts of each variable)')
+    parser.add_argument('--query', type=str, default=None, metavar='NAME',
+                        help='List the casts that use variable NAME (i.e. sbeox0Mm/Kg) from OUTPUT.sqlite, without a scan')
     args = parser.parse_args()
 
-    variable_counts = scan_directory(args.directory)
+    if args.query:
+        if not args.output:
+            parser.error('--query requires --output')
+        if not os.path.exists(args.output + '.sqlite'):
+            parser.error(f'{args.output}.sqlite does not exist, run a scan with --output {args.output} first')
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(['cruise', 'cast', 'file', 'description', 'unit'])
+        writer.writerows(query_inventory(args.output, args.query))
+        return
+    if not args.directory:
+        parser.error('directory is required')
+
+    variable_counts, variable_casts = scan_directory(args.directory, tuple('.' + extension for extension in args.extensions), args.workers)
     print('name,description,unit,file_count')
     for variable, count in variable_counts.items():
         print(f'{variable.name},"{variable.description}","{variable.unit}",{count}')
+    if args.output:
+        write_inventory(args.output, variable_counts, variable_casts)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,92 @@
+# Read a SeaBird processed header (.hdr) file once into a structured record, so that checks can use
+# dictionary lookups instead of re-reading the file for every check and every sensor.
+# The header of .cnv and .btl files is read the same way: reading stops at the *END* line (or the first line
+# that is not a '*' or '#' header line), so the scan data that follows is never read or decoded.
+
+from collections import namedtuple
+import os
+import re
+
+# file types that start with a SeaBird header, in order of preference when a cast has several
+HEADER_EXTENSIONS = ('.hdr', '.cnv', '.btl')
+
+# latitude, longitude: (degrees, minutes, direction) tuples or None, nmea_time: text or None
+# variables: name index -> (name, description), name_index: name -> list of name indexes (duplicates have several)
+# spans: name index -> (min, max) as text, mod_error: True if any line contains modError
+# duplicates: variable names found more than once, in file order
+HeaderRecord = namedtuple('HeaderRecord', ['file', 'latitude', 'longitude', 'nmea_time', 'variables', 'name_index',
+                                           'spans', 'mod_error', 'duplicates'])
+
+NMEA_LATITUDE = re.compile(r'NMEA Latitude = (\d+) (\d+\.\d+) (\w)')
+NMEA_LONGITUDE = re.compile(r'NMEA Longitude = (\d+) (\d+\.\d+) (\w)')
+NMEA_TIME = re.compile(r'NMEA UTC \(Time\) = (.*)')
+NAME = re.compile(r'# name (\d+) = ([^:]+): ?(.*)')
+SPAN = re.compile(r'# span (\d+) =\s*([^,]+),\s*(\S+)')
+
+def parse_header(lines, file=''):
+    latitude = None
+    longitude = None
+    nmea_time = None
+    variables = {}
+    name_index = {}
+    spans = {}
+    mod_error = False
+    duplicates = []
+
+    for line in lines:
+        if line.startswith('# name'):
+            match = NAME.match(line)
+            if match:
+                number, name, description = match.groups()
+                variables[number] = (name, description.strip())
+                if name in name_index:
+                    duplicates.append(name)
+                name_index.setdefault(name, []).append(number)
+        elif line.startswith('# span'):
+            match = SPAN.match(line)
+            if match:
+                spans[match.group(1)] = (match.group(2).strip(), match.group(3).strip())
+        elif 'NMEA' in line:
+            match = NMEA_LATITUDE.search(line)
+            if match:
+                latitude = match.groups()
+            match = NMEA_LONGITUDE.search(line)
+            if match:
+                longitude = match.groups()
+            match = NMEA_TIME.search(line)
+            if match:
+                nmea_time = match.group(1).strip()
+        if 'modError' in line:
+            mod_error = True
+
+    return HeaderRecord(file, latitude, longitude, nmea_time, variables, name_index, spans, mod_error, duplicates)
+
+def read_header_bytes(file):
+    # Return the header lines of a .hdr, .cnv or .btl file as bytes, up to and including *END*
+    lines = []
+    with open(file, 'rb') as f:     # buffered binary reads, lines after the header are not decoded
+        for line in f:
+            if not line.startswith((b'*', b'#')) and line.strip():
+                break
+            lines.append(line)
+            if line.startswith(b'*END*'):
+                break
+    return b''.join(lines)
+
+def read_header_lines(file):
+    return read_header_bytes(file).decode('latin-1').splitlines()
+
+def read_header(file):
+    return parse_header(read_header_lines(file), file)
+
+def prefer_header_files(files, extensions=HEADER_EXTENSIONS):
+    # Keep one file per cast (directory and base name), i.e. the .hdr if there is one, otherwise the .cnv
+    preferred = {}
+    for file in files:
+        stem, extension = os.path.splitext(file)
+        extension = extension.lower()
+        if extension not in extensions:
+            continue
+        if stem not in preferred or extensions.index(extension) < extensions.index(os.path.splitext(preferred[stem])[1].lower()):
+            preferred[stem] = file
+    return sorted(preferred.values())
@@ -5,12 +5,28 @@ import argparse
 from glob import glob
 import os
 import pandas as pd
-import datetime as dt
+from underway_utils import read_par_files, merge_par
 
 START_TIME = '2023-04-29 03:29:51'
 DATE = 'date'
+SAMPLE_COUNT = 'sample_count'
 
-def clean_data(path):
+def bin_minutes(df, how='first'):
+    # Group the records into 1-minute bins on the UTC timestamp and keep the first record (whole row, same
+    # columns and date) of each bin. With how mean or median the numeric columns of that record are replaced
+    # by the mean or median of the bin. Bins without records (dropouts) are left out and sample_count
+    # (appended as the last column) is the number of records in each bin
+    minutes = df[DATE].dt.floor('1min')
+    groups = df.groupby(minutes)
+    binned = groups.head(1)
+    bin_keys = minutes.loc[binned.index]
+    if how != 'first':
+        numeric = [column for column in df.columns if column != DATE and pd.api.types.is_numeric_dtype(df[column])]
+        binned[numeric] = groups[numeric].agg(how).loc[bin_keys].to_numpy()
+    binned[SAMPLE_COUNT] = groups.size().loc[bin_keys].to_numpy()
+    return binned.reset_index(drop=True)
+
+def clean_data(path, how='first', par_tolerance=30):
     # read in and concatenate the 10-sec SMS .txt files
     dfs = []
     print("Path:", path)
@@ -49,12 +65,15 @@ def clean_data(path):
     # The SMS data computer time is the leftmost Time GMT - use this one and drop the other duplicate Time GMT
     df = df.loc[:,~df.columns.duplicated()].copy()
 
-    # create an ISO 8601 datetime column (this is the “date” column in product)
-    date_series = df['Date_GMT'].copy()
-    date_obj = date_series.apply(lambda x: dt.datetime.strptime(x, '%m/%d/%Y'))
+    # create an ISO 8601 datetime column (this is the “date” column in product), malformed dates become NaT
+    date_obj = pd.to_datetime(df['Date_GMT'], format='%m/%d/%Y', errors='coerce')
     formatted_date = date_obj.dt.strftime('%Y-%m-%d')
-    datetime = formatted_date + ' ' + df[('Time_GMT')].copy()
-    df.insert(1, DATE, pd.to_datetime(datetime, utc=True, format="ISO8601"))
+    datetime = formatted_date + ' ' + df['Time_GMT'].astype(str).str.strip()
+    df.insert(1, DATE, pd.to_datetime(datetime, utc=True, format="ISO8601", errors='coerce'))
+    invalid = df[DATE].isna().sum()
+    if invalid > 0:
+        print(f"Dropping {invalid} SMS records with invalid Date GMT or Time GMT")
+        df = df.dropna(subset=[DATE])
     # drop original Date and Time GMT column since we have the date & time in the new date field
     df = df.drop('Date_GMT', axis=1)
     df = df.drop('Time_GMT', axis=1)
@@ -65,9 +84,8 @@ def clean_data(path):
     start_time = pd.to_datetime(START_TIME, utc=True, format="ISO8601")
     # Filter and drop rows where the column values are less than the start time
     df = df[df[DATE] >= start_time]
-    # decimate the datetime to 1-min frequency by selecting every 6th row
-    df.reset_index(drop=True, inplace=True)
-    df = df[::6].reset_index(drop=True)
+    # decimate the 10-sec data to 1-min frequency by binning on the UTC timestamp
+    df = bin_minutes(df, how)
 
     # change decimal longitude (column Longitude Deg) to (-)
     df['Longitude_Deg'] = -df['Longitude_Deg']
@@ -77,30 +95,13 @@ def clean_data(path):
     # calibration = df['Fluorometer_Turner Raw'] * 10
     # df.insert(df.columns.get_loc('Fluorometer_Turner Raw') + 1, 'fluorometer_cal', calibration)
 
-    # read in and concatenate the PAR files
-    pfs = []
-    for file in glob(os.path.join(path, 'BSI2023*.csv')):
-        data = pd.read_csv(file, delimiter=',', skiprows=9, encoding='cp1252') # Specify header=None to treat all rows as data
-        pfs.append(data)
-    pdf = pd.concat(pfs, ignore_index=True)
-    
-    # create an ISO 8601 datetime column (this is the “Time” column in product)
-    date_series = pdf['Time'].copy()
-    # invalid data in BSI20230502_154704.csv line 5931
-    # date_obj = date_series.apply(lambda x: dt.datetime.strptime(x, '%m/%d/%Y %I:%M:%S %p'))
- 
-    def parse_date(x):
-        try:
-            return dt.datetime.strptime(x, '%m/%d/%Y %I:%M:%S %p')
-        except ValueError:
-            return pd.NaT  # Return a "Not a Time" value for invalid dates
-    datetime = date_series.apply(parse_date)
-
-    pdf.insert(1, DATE, pd.to_datetime(datetime, utc=True, format="ISO8601"))
+    # read in and concatenate the Time and PAR sensor columns of the PAR files
+    # (this is the “Time” column in product, invalid data in BSI20230502_154704.csv line 5931 becomes NaT)
+    pdf = read_par_files(glob(os.path.join(path, 'BSI2023*.csv')), skiprows=9, time_format='%m/%d/%Y %I:%M:%S %p')
     
-    # Merge "QSR - S/N 10367" underway data from the Light Logger Par data files based on time
+    # Merge "QSR - S/N 10367" underway data from the Light Logger Par data files based on nearest time
     # into new column in the resulting dataFrame
-    df = df.merge(pdf[['date', 'QSR - S/N 10367']], on='date', how='left')
+    df = merge_par(df, pdf, tolerance=par_tolerance)
 
     # write dataframe to underway file
     df.to_csv('HRS2303_Data60Sec_200429-0000.csv', index=False)
@@ -108,9 +109,12 @@ def clean_data(path):
 def main():
     parser = argparse.ArgumentParser(description='Clean Sharp Underway Cruise Data for REST API.')
     parser.add_argument('path', type=str, help='Path to data files')
+    parser.add_argument('--agg', type=str, default='first', choices=['first', 'mean', 'median'], help='How the 10-sec records in each 1-minute bin are combined (default: first)')
+
+    parser.add_argument('--par-tolerance', type=float, default=30, help='Maximum time difference in seconds between a record and the PAR value merged into it (default: 30)')
 
     args = parser.parse_args()
-    clean_data(args.path)
+    clean_data(args.path, args.agg, args.par_tolerance)
 
 if __name__ == '__main__':
     main()
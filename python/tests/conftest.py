@@ -0,0 +1,5 @@
+# the scripts are flat modules in python/, import them the way they import each other
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
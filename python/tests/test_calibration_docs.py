@@ -0,0 +1,98 @@
+import functools
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+import pytest
+from calibration_docs import close_document_cache, is_url, load_document, local_path, open_document_cache, url_scheme
+
+XML = b'<SBE_InstrumentConfiguration><SerialNumber>4321</SerialNumber></SBE_InstrumentConfiguration>'
+
+class ETagHandler(SimpleHTTPRequestHandler):
+    # SimpleHTTPRequestHandler sends Last-Modified only, the tests set the ETag of each path
+    etags = {}
+
+    def end_headers(self):
+        etag = self.etags.get(self.path)
+        if etag:
+            self.send_header('ETag', etag)
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server(tmp_path):
+    ETagHandler.etags = {}
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(ETagHandler, directory=str(tmp_path)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+def counters(cache):
+    return cache.counters['memory_hits'], cache.counters['disk_hits'], cache.counters['misses']
+
+def test_scheme_dispatch(tmp_path):
+    assert url_scheme('http://host/SBE3_4321.xml') == 'http' and is_url('HTTPS://host/SBE3_4321.xml')
+    assert not is_url('C:\\cal\\SBE3_4321.xml') and url_scheme('C:\\cal\\SBE3_4321.xml') == ''
+    path = tmp_path / 'SBE3_4321.xml'
+    path.write_bytes(XML)
+    assert local_path(path.as_uri()) == str(path)
+    cache = open_document_cache()
+    # a file: URL and the path are the same document
+    assert load_document(cache, path.as_uri()).find('SerialNumber').text == '4321'
+    assert load_document(cache, str(path)).find('SerialNumber').text == '4321'
+    assert counters(cache) == (1, 0, 1)
+
+def test_local_memory_disk_and_mtime(tmp_path):
+    path = tmp_path / 'SBE3_4321.xml'
+    path.write_bytes(XML)
+    cache_file = str(tmp_path / 'cache' / 'docs.sqlite')
+    cache = open_document_cache(cache_file)
+    load_document(cache, str(path))
+    load_document(cache, str(path))
+    assert counters(cache) == (1, 0, 1)
+    close_document_cache(cache)
+
+    # a new run finds the document in the disk tier
+    cache = open_document_cache(cache_file)
+    assert load_document(cache, str(path)).find('SerialNumber').text == '4321'
+    assert counters(cache) == (0, 1, 0)
+    close_document_cache(cache)
+
+    # a changed file is read again
+    path.write_bytes(XML.replace(b'4321', b'4322'))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000_000))
+    cache = open_document_cache(cache_file)
+    assert load_document(cache, str(path)).find('SerialNumber').text == '4322'
+    assert counters(cache) == (0, 0, 1)
+    close_document_cache(cache)
+
+def test_http_memory_disk_and_etag(tmp_path, server):
+    (tmp_path / 'SBE3_4321.xml').write_bytes(XML)
+    ETagHandler.etags['/SBE3_4321.xml'] = '"v1"'
+    url = f'{server}/SBE3_4321.xml'
+    cache_file = str(tmp_path / 'docs.sqlite')
+    cache = open_document_cache(cache_file)
+    assert load_document(cache, url).find('SerialNumber').text == '4321'
+    load_document(cache, url)
+    assert counters(cache) == (1, 0, 1)
+    close_document_cache(cache)
+
+    cache = open_document_cache(cache_file)
+    load_document(cache, url)
+    assert counters(cache) == (0, 1, 0)
+    close_document_cache(cache)
+
+    # same ETag: the disk tier is trusted even though the content on the server changed
+    (tmp_path / 'SBE3_4321.xml').write_bytes(XML.replace(b'4321', b'4322'))
+    cache = open_document_cache(cache_file)
+    assert load_document(cache, url).find('SerialNumber').text == '4321'
+    close_document_cache(cache)
+
+    ETagHandler.etags['/SBE3_4321.xml'] = '"v2"'
+    cache = open_document_cache(cache_file)
+    assert load_document(cache, url).find('SerialNumber').text == '4322'
+    assert counters(cache) == (0, 0, 1)
+    close_document_cache(cache)
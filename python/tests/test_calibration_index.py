@@ -0,0 +1,39 @@
+import os
+from calibration_index import PRIMARY_DIR, build_calibration_index, find_calib_file_with_serial_number, find_calib_files
+
+def touch(directory, *names):
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        open(os.path.join(directory, name), 'w').close()
+
+def test_newest_first_prefix_and_directories(tmp_path):
+    touch(tmp_path, 'SBE3_4321_20230203.xml', 'SBE3_4321_20240105.xml', 'SBE3_4321_05Jan25.pdf',
+          'SBE3_T4321_20220101.xml', 'SBE4_C4321_20240301.xml', 'SBE3_4321_Repair_20250101.xml', 'SBE9_0987_10Mar22.pdf')
+    touch(tmp_path / 'SBE43_1111', 'SBE43_1111_20230101.pdf', 'SBE43_1111_20240101.pdf')
+    index = build_calibration_index(str(tmp_path))
+    url = str(tmp_path).replace('\\', '/')
+
+    # .xml files are preferred to a newer .pdf, _Repair files are left out
+    assert find_calib_files(index, '4321') == [f'{url}/SBE4_C4321_20240301.xml', f'{url}/SBE3_4321_20240105.xml',
+                                               f'{url}/SBE3_4321_20230203.xml', f'{url}/SBE3_T4321_20220101.xml']
+    assert find_calib_file_with_serial_number(index, '4321', 'T') == f'{url}/SBE3_T4321_20220101.xml'
+    assert find_calib_file_with_serial_number(index, '4321', 'C') == f'{url}/SBE4_C4321_20240301.xml'
+    assert find_calib_file_with_serial_number(index, 's/n 0987') == f'{url}/SBE9_0987_10Mar22.pdf'
+    assert find_calib_file_with_serial_number(index, '1111') == f'{url}/SBE43_1111/SBE43_1111_20240101.pdf'
+    assert find_calib_file_with_serial_number(index, '5555') is None
+
+def test_lookups_are_memoized(tmp_path):
+    touch(tmp_path, 'SBE3_4321_20230203.xml')
+    index = build_calibration_index(str(tmp_path))
+    files = find_calib_files(index, '4321')
+    # the directory is listed once, a file added after the index was built is not seen
+    touch(tmp_path, 'SBE3_4321_20240105.xml')
+    assert find_calib_files(index, '4321') is files
+    assert set(index.matches) == {('4321', '')}
+    assert len(build_calibration_index(str(tmp_path)).files) == 2
+
+def test_primary_directory_first(tmp_path):
+    touch(tmp_path, 'SBE3_4321_20240105.xml')
+    touch(tmp_path / PRIMARY_DIR, 'SBE3_4321_20230203.xml')
+    index = build_calibration_index(str(tmp_path))
+    assert find_calib_file_with_serial_number(index, '4321').endswith(f'{PRIMARY_DIR}/SBE3_4321_20230203.xml')
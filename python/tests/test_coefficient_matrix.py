@@ -0,0 +1,59 @@
+import numpy as np
+from calibration_docs import open_document_cache
+from calibration_engine import UNDERWAY
+from calibration_index import build_calibration_index
+from coefficient_matrix import compare_matrix, extract_matrix, reference_matrix
+
+XMLCON = """<?xml version="1.0" encoding="UTF-8"?>
+<SBE_InstrumentConfiguration><Instrument><SensorArray>
+  <Sensor index="0"><TemperatureSensor>
+    <SerialNumber>4322</SerialNumber><CalibrationDate>05-Jan-24</CalibrationDate>
+    <G>{g}</G><H>6.25e-004</H><F0>1000.000</F0>
+  </TemperatureSensor></Sensor>
+</SensorArray></Instrument></SBE_InstrumentConfiguration>
+"""
+
+CALIBRATION = """<?xml version="1.0" encoding="UTF-8"?>
+<SBE_InstrumentCalibration><TemperatureSensor>
+  <SerialNumber>4322</SerialNumber><CalibrationDate>05-Jan-24</CalibrationDate>
+  <G>{g}</G><H>6.25e-004</H><F0>1000.0</F0>
+</TemperatureSensor></SBE_InstrumentCalibration>
+"""
+
+def write_cruise(tmp_path, calibration_files):
+    raw = tmp_path / 'raw'
+    raw.mkdir()
+    for cast, g in (('001', '4.40e-003'), ('002', '4.33e-003'), ('003', '4.33e-003'), ('005', '4.33e-003')):
+        (raw / f'ar99_{cast}.XMLCON').write_text(XMLCON.format(g=g))
+    calib = tmp_path / 'doc'
+    calib.mkdir()
+    for name, g in calibration_files.items():
+        (calib / name).write_text(CALIBRATION.format(g=g))
+    return sorted(str(file) for file in raw.iterdir()), build_calibration_index(str(calib))
+
+def test_compare_matrix_lists_each_difference_with_its_casts(tmp_path):
+    files, calib_index = write_cruise(tmp_path, {'SBE3_4322_20240105.xml': '4.40e-003'})
+    document_cache = open_document_cache()
+    matrix = extract_matrix(files, document_cache)
+    assert matrix['value'].dtype == np.float64
+    assert len(matrix) == 3 * len(files)
+
+    reference, no_xml = reference_matrix([('4322', 'TemperatureSensor')], calib_index, document_cache)
+    assert no_xml == []
+    differences = compare_matrix(matrix, reference)
+    assert differences[['serial', 'coefficient', 'xmlcon_value', 'calibration_value', 'casts']].values.tolist() == \
+        [['4322', 'G', 0.00433, 0.0044, '002-003, 005']]
+
+def test_compare_matrix_tolerance(tmp_path):
+    files, calib_index = write_cruise(tmp_path, {'SBE3_4322_20240105.xml': '4.40e-003'})
+    document_cache = open_document_cache()
+    matrix = extract_matrix(files, document_cache)
+    reference, _ = reference_matrix([('4322', 'TemperatureSensor')], calib_index, document_cache)
+    assert compare_matrix(matrix, reference, rtol=0.02).empty
+
+def test_reference_matrix_uses_the_family_prefix(tmp_path):
+    # the newer SBE4 conductivity sheet has the same serial number, the underway T prefix picks the SBE3 sheet
+    _, calib_index = write_cruise(tmp_path, {'SBE3_T4322_20240105.xml': '4.33e-003', 'SBE4_C4322_20240301.xml': '9.99e-003'})
+    reference, no_xml = reference_matrix([('4322', 'TemperatureSensor')], calib_index, open_document_cache(), UNDERWAY)
+    assert no_xml == []
+    assert reference.loc[reference['coefficient'] == 'G', 'calibration_value'].tolist() == [0.00433]
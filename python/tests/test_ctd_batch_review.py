@@ -0,0 +1,79 @@
+import csv
+import multiprocessing
+import os
+import sqlite3
+import pytest
+import calibration_engine as engine
+import ctd_batch_review
+import ctd_review
+from calibration_docs import close_document_cache
+
+XMLCON = '''<?xml version="1.0" encoding="UTF-8"?>
+<SBE_InstrumentConfiguration>
+  <Instrument>
+    <SensorArray Size="1">
+      <Sensor index="0" SensorID="55">
+        <TemperatureSensor SensorID="55">
+          <SerialNumber>4321</SerialNumber>
+          <CalibrationDate>05-Jan-24</CalibrationDate>
+          <G>4.33e-003</G>
+          <H>6.25e-004</H>
+        </TemperatureSensor>
+      </Sensor>
+    </SensorArray>
+  </Instrument>
+</SBE_InstrumentConfiguration>
+'''
+
+CALIBRATION = '''<?xml version="1.0" encoding="UTF-8"?>
+<SBE_InstrumentCalibration>
+  <TemperatureSensor SensorID="55">
+    <SerialNumber>4321</SerialNumber>
+    <CalibrationDate>05-Jan-24</CalibrationDate>
+    <G>{g}</G>
+    <H>6.25e-004</H>
+  </TemperatureSensor>
+</SBE_InstrumentCalibration>
+'''
+
+def make_cruise(directory, cruise, g):
+    raw = directory / f'ship-provided_data_{cruise}' / 'ctd' / 'raw'
+    doc = raw.parent / 'doc'
+    raw.mkdir(parents=True)
+    doc.mkdir()
+    for cast in ('001', '002'):
+        (raw / f'{cruise.lower()}_{cast}.XMLCON').write_text(XMLCON)
+    (doc / 'SBE3_4321_20240105.xml').write_text(CALIBRATION.format(g=g))
+
+def close_and_mark(cache):
+    close_document_cache(cache)
+    with open(os.path.join(os.environ['CLOSED_CACHE_DIR'], str(os.getpid())), 'w'):
+        pass
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='the workers see the patched close function only when forked')
+def test_two_cruises_in_the_pool(tmp_path, monkeypatch):
+    make_cruise(tmp_path, 'AR99', '4.33e-003')
+    make_cruise(tmp_path, 'EN99', '4.35e-003')
+    closed = tmp_path / 'closed'
+    closed.mkdir()
+    monkeypatch.setenv('CLOSED_CACHE_DIR', str(closed))
+    monkeypatch.setattr(ctd_batch_review, 'close_document_cache', close_and_mark)
+    monkeypatch.setattr(ctd_review, 'current_dir', str(tmp_path))
+    cache_file = str(tmp_path / 'cache' / 'docs.sqlite')
+    output = str(tmp_path / 'failed.csv')
+
+    results = ctd_batch_review.review_cruises([str(tmp_path / 'ship-provided_data_*' / 'ctd' / 'raw')],
+                                              workers=2, cache_file=cache_file, output=output)
+
+    assert [(instrument, cruise) for instrument, cruise, _, _ in results] == [(engine.CTD.name, 'AR99'), (engine.CTD.name, 'EN99')]
+    assert all(os.path.exists(results_file) for _, _, results_file, _ in results)
+    with open(output, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows == [['instrument', 'cruise', 'serial_number', 'results_file'],
+                    [engine.CTD.name, 'EN99', '4321', results[1][2]]]
+
+    # every worker that reviewed a cruise closed its cache, both calibration files are in the shared disk tier
+    assert len(os.listdir(closed)) >= 1
+    with sqlite3.connect(cache_file) as connection:
+        paths = [row[0] for row in connection.execute("SELECT path FROM documents WHERE path LIKE '%SBE3_4321%'")]
+    assert len(paths) == 2
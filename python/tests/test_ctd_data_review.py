@@ -0,0 +1,46 @@
+from ctd_data_review import default_limits, review_data, review_scans
+
+HEADER = """* Sea-Bird SBE 9 Data File:
+# nquan = 3
+# name 0 = prDM: Pressure, Digiquartz [db]
+# name 1 = pumps: Pump Status
+# name 2 = t090C: Temperature [ITS-90, deg C]
+# span 0 =      -0.500,     600.000
+# span 1 =           0,           1
+# span 2 =      10.000,      12.000
+# file_type = ascii
+*END*
+"""
+
+def write_cast(path, scans):
+    path.write_text(HEADER + ''.join(f"{pressure} {pumps} {temperature}\n" for pressure, pumps, temperature in scans))
+    return str(path)
+
+# deck scans with the pumps off, then one scan past the prDM limit with the pumps on
+SCANS = [(-0.5, 0, 10.0), (-0.5, 0, 10.0), (10.0, 1, 11.0), (20.0, 1, 12.0), (600.0, 1, 12.0)]
+
+def errors(findings):
+    return [finding.message for finding in findings if finding.severity == 'ERROR']
+
+def test_limits_are_checked_with_the_pumps_on(tmp_path):
+    stats, findings = review_scans(write_cast(tmp_path / 'ar99001.cnv', SCANS), default_limits())
+    assert [channel.name for channel in stats] == ['prDM', 'pumps', 't090C']
+    assert stats[0].count == 5 and stats[0].min == -0.5 and stats[0].max == 600.0
+    assert len(errors(findings)) == 1
+    assert errors(findings)[0].startswith("Sensor prDM 1 of 3 scans with the pumps on (33.33%)")
+
+def test_all_scans(tmp_path):
+    stats, findings = review_scans(write_cast(tmp_path / 'ar99001.cnv', SCANS), default_limits(), all_scans=True)
+    messages = errors(findings)
+    assert any(message.startswith("Sensor prDM 3 of 5 scans (60.00%)") for message in messages)
+    assert any(message.startswith("Sensor pumps 2 of 5 scans (40.00%)") for message in messages)
+
+def test_malformed_scan_is_reported_per_file(tmp_path, capsys):
+    write_cast(tmp_path / 'ar99001.cnv', [(10.0, 1, '1x1.0')])
+    write_cast(tmp_path / 'ar99002.cnv', SCANS[2:4])
+    results = review_data(str(tmp_path), default_limits())
+    assert [stats for _, stats in results][0] == []
+    assert len(results[1][1]) == 3
+    output = capsys.readouterr().out
+    assert "ERROR: Could not read the scan data" in output
+    assert "ERRORS FOUND!" in output
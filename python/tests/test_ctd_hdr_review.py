@@ -0,0 +1,16 @@
+import os
+from ctd_hdr_review import Finding, cached_findings, open_cache, store_findings
+
+def test_cached_findings_use_the_path_of_this_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('cr')
+    with open(os.path.join('cr', 'ar99001.hdr'), 'w') as f:
+        f.write('# name 0 = prDM: Pressure, Digiquartz [db]\n*END*\n')
+    connection = open_cache(str(tmp_path / 'cache' / 'ctd_hdr_review_cache.sqlite'))
+    findings = [Finding('ERROR', 'sensors', 'cr/ar99001.hdr', 'Sensor t090C missing')]
+    store_findings(connection, 'cr/ar99001.hdr', 'sha', findings, '1')
+
+    cached = cached_findings(connection, './cr/ar99001.hdr', '1')
+    assert cached == [Finding('ERROR', 'sensors', './cr/ar99001.hdr', 'Sensor t090C missing')]
+    assert cached_findings(connection, 'cr/ar99001.hdr', '2') is None
+    connection.close()
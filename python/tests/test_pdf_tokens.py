@@ -0,0 +1,26 @@
+from datetime import date
+from pdf_tokens import has_date, has_number, pdf_tokens
+
+SHEET = """SENSOR SERIAL NUMBER: 4322  CALIBRATION DATE: 05-Jan-24
+g = 4.33e-03  h = 6.2500e-004  i = 0.0000210  f0 = 1000.0
+Previous cal February 3, 2023  Checked 2024-01-12"""
+
+def test_has_number_any_notation():
+    assert has_number(SHEET, '4.33000000e-003')
+    assert has_number(SHEET, '0.000625')
+    assert has_number(SHEET, '2.1e-5')
+    assert has_number(SHEET, '1000.000')
+
+def test_has_number_more_precise_value_does_not_match():
+    assert not has_number(SHEET, '4.331e-3')
+    assert not has_number(SHEET, '4.34e-3')
+    assert not has_number(SHEET, 'not a number')
+
+def test_has_date_any_format():
+    assert has_date(SHEET, date(2024, 1, 5))
+    assert has_date(SHEET, date(2023, 2, 3))
+    assert has_date(SHEET, date(2024, 1, 12))
+    assert not has_date(SHEET, date(2024, 5, 1))
+
+def test_tokens_are_indexed_once():
+    assert pdf_tokens(SHEET) is pdf_tokens(SHEET)
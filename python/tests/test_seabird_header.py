@@ -0,0 +1,31 @@
+from seabird_header import parse_header
+
+HEADER = """* Sea-Bird SBE 9 Data File:
+* NMEA Latitude = 41 11.50 N
+* NMEA Longitude = 070 53.25 W
+* NMEA UTC (Time) = Apr 29 2023 03:29:51
+# name 0 = prDM: Pressure, Digiquartz [db]
+# name 1 = t090C: Temperature [ITS-90, deg C]
+# name 2 = t090C: Temperature [ITS-90, deg C]
+# name 3 = modError: Modulo Error Count
+# span 0 =      -0.123,     400.500
+# span 1 =      3.0001,          22
+*END*
+""".splitlines()
+
+def test_parse_header():
+    record = parse_header(HEADER, 'ar99001.hdr')
+    assert record.file == 'ar99001.hdr'
+    assert record.latitude == ('41', '11.50', 'N')
+    assert record.longitude == ('070', '53.25', 'W')
+    assert record.nmea_time == 'Apr 29 2023 03:29:51'
+    assert record.variables['0'] == ('prDM', 'Pressure, Digiquartz [db]')
+    assert record.name_index['t090C'] == ['1', '2']
+    assert record.duplicates == ['t090C']
+    assert record.spans == {'0': ('-0.123', '400.500'), '1': ('3.0001', '22')}
+    assert record.mod_error
+
+def test_parse_header_without_nmea():
+    record = parse_header(['# name 0 = prDM: Pressure, Digiquartz [db]'])
+    assert record.latitude is None and record.nmea_time is None
+    assert record.duplicates == [] and not record.mod_error
@@ -0,0 +1,24 @@
+import pandas as pd
+from sharp_data_cleaning import DATE, SAMPLE_COUNT, bin_minutes
+
+def records():
+    return pd.DataFrame({
+        DATE: pd.to_datetime(['2023-04-29 03:30:05', '2023-04-29 03:30:35', '2023-04-29 03:31:10',
+                              '2023-04-29 03:33:00'], utc=True),
+        'temperature': [10.0, 12.0, 11.0, 9.0],
+        'status': ['a', 'b', 'c', 'd'],
+    })
+
+def test_bin_minutes_keeps_first_whole_record():
+    binned = bin_minutes(records())
+    assert list(binned.columns) == [DATE, 'temperature', 'status', SAMPLE_COUNT]
+    assert binned[DATE].tolist() == records()[DATE].iloc[[0, 2, 3]].tolist()
+    assert binned['temperature'].tolist() == [10.0, 11.0, 9.0]
+    assert binned['status'].tolist() == ['a', 'c', 'd']
+    assert binned[SAMPLE_COUNT].tolist() == [2, 1, 1]
+
+def test_bin_minutes_mean_replaces_numeric_columns_only():
+    binned = bin_minutes(records(), how='mean')
+    assert binned['temperature'].tolist() == [11.0, 11.0, 9.0]
+    assert binned['status'].tolist() == ['a', 'c', 'd']
+    assert binned[DATE].iloc[0] == records()[DATE].iloc[0]
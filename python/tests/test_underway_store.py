@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from underway_store import ingest, load_underway
+
+def write_day(directory, name, rows):
+    lines = ['WHOI SSSG dsLogCsv V1.0 AR61b 1min', 'DATE_GMT, TIME_GMT, Dec_LAT, SBE45S, GPGGA']
+    (directory / name).write_text('\r\n'.join(lines + rows) + '\r\n')
+
+def test_days_with_different_column_contents_load_together(tmp_path):
+    # SBE45S has no value on the first day and a corrupt value on the second, GPGGA is text
+    raw = tmp_path / 'proc'
+    raw.mkdir()
+    write_day(raw, 'AR211028_0000.csv', ['2021/10/28, 23:58:00.800, 41.5, NAN, $GPGGA 1',
+                                         '2021/10/28, 23:59:00.800, 41.6, NAN, NAN'])
+    write_day(raw, 'AR211029_0000.csv', ['2021/10/29, 00:00:00.800, 4x1.5, 32.1, $GPGGA 2',
+                                         '2021/10/29, 00:01:00.800, 41.8, 32.2, $GPGGA 3'])
+    store = tmp_path / 'store'
+    ingest(str(raw), str(store))
+
+    df = load_underway(str(store))
+    assert len(df) == 4
+    assert df.index[0] == pd.Timestamp('2021-10-28 23:58:00.8', tz='UTC')
+    assert df['Dec_LAT'].dtype == np.float64
+    assert np.isnan(df['Dec_LAT'].iloc[2])
+    assert df['Dec_LAT'].iloc[3] == 41.8
+    assert df['SBE45S'].isna().tolist() == [True, True, False, False]
+    assert df['GPGGA'].tolist()[2:] == ['$GPGGA 2', '$GPGGA 3']
+
+def test_load_underway_time_range_naive_or_tz_aware(tmp_path):
+    raw = tmp_path / 'proc'
+    raw.mkdir()
+    write_day(raw, 'AR211028_0000.csv', ['2021/10/28, 23:59:00.800, 41.6, 32.0, NAN'])
+    write_day(raw, 'AR211029_0000.csv', ['2021/10/29, 00:00:00.800, 41.7, 32.1, NAN'])
+    store = tmp_path / 'store'
+    ingest(str(raw), str(store))
+
+    assert load_underway(str(store), start='2021-10-29').index.tolist() == [pd.Timestamp('2021-10-29 00:00:00.8', tz='UTC')]
+    assert len(load_underway(str(store), start='2021-10-28 19:00-04:00', end='2021-10-28 20:00-04:00')) == 1
@@ -0,0 +1,141 @@
+import os
+import stat
+import numpy as np
+import pandas as pd
+import pytest
+from underway_utils import (DATE_GMT, FILE_ROW, PAR_DATE, TIME_GMT, TIME_MS, TimeIndex, dslog_times, fill_nearest_time, find_gaps,
+                            merge_par, nearest_row, read_dslog_csv, replace_file, synthesize_rows, write_dslog_csv)
+
+DSLOG = (b'WHOI SSSG dsLogCsv V1.0 AR70b 1min\r\n'
+         b'DATE_GMT, TIME_GMT, Dec_LAT, Dec_LON, SBE45S, FLR\r\n'
+         b'2022/11/20, 00:00:00.800, 41.000000, -70.100000, 32.100,\r\n'
+         b'2022/11/20, 00:01:00.800, NAN, NAN, 32.1000, 0.0420\r\n')
+
+def time_index(*times, **columns):
+    data = pd.DataFrame({TIME_GMT: list(times)})
+    data.insert(0, TIME_MS, [int(pd.Timedelta(time.strip()).total_seconds() * 1000) for time in times])
+    data.insert(1, FILE_ROW, np.arange(len(times), dtype='int64') + 10)
+    for column, values in columns.items():
+        data[' ' + column] = values
+    return TimeIndex('gps.csv', data, [])
+
+def underway(*times):
+    return pd.DataFrame({TIME_GMT: list(times), ' Dec_LAT': ' NAN', ' SBE45S': ' 30.1'})
+
+def test_fill_nearest_time_fills_from_nearest_sample():
+    df = underway(' 00:00:00.800', ' 00:01:00.800', ' 00:02:00.800')
+    index = time_index(' 00:00:01.000', ' 00:01:02.500', ' 00:01:59.000', DPS112_LAT=[' 41.1', ' 41.2', ' 41.3'])
+    rows = pd.Series([True, False, True])
+    report, unmatched = fill_nearest_time(df, index, {' Dec_LAT': ' DPS112_LAT'}, rows)
+    assert df[' Dec_LAT'].tolist() == [' 41.1', ' NAN', ' 41.3']
+    assert unmatched == []
+    assert list(report.columns) == ['ROW', TIME_GMT, 'COLUMN', 'SOURCE_FILE', 'SOURCE_ROW', 'SOURCE_TIME_GMT', 'OFFSET_SECONDS']
+    assert report['ROW'].tolist() == [0, 2]
+    assert report['COLUMN'].tolist() == [' Dec_LAT', ' Dec_LAT']
+    assert report['SOURCE_FILE'].tolist() == ['gps.csv', 'gps.csv']
+    assert report['SOURCE_ROW'].tolist() == [10, 12]
+    assert report['SOURCE_TIME_GMT'].tolist() == [' 00:00:01.000', ' 00:01:59.000']
+    assert report['OFFSET_SECONDS'].tolist() == [0.2, -1.8]
+
+def test_fill_nearest_time_tolerance():
+    df = underway(' 00:00:00.800', ' 00:01:00.800')
+    index = time_index(' 00:00:01.000', ' 00:01:05.800', DPS112_LAT=[' 41.1', ' 41.2'])
+    report, unmatched = fill_nearest_time(df, index, {' Dec_LAT': ' DPS112_LAT'}, pd.Series([True, True]), tolerance=2)
+    assert df[' Dec_LAT'].tolist() == [' 41.1', ' NAN']
+    assert unmatched == [1]
+    assert report['ROW'].tolist() == [0]
+
+def test_fill_nearest_time_skips_missing_source_values_and_bad_times():
+    df = underway(' 00:00:00.800', ' bad time')
+    index = time_index(' 00:00:00.800', DPS112_LAT=[' NAN'])
+    report, unmatched = fill_nearest_time(df, index, {' Dec_LAT': ' DPS112_LAT'}, pd.Series([True, True]))
+    assert df[' Dec_LAT'].tolist() == [' NAN', ' NAN']
+    assert unmatched == [1]
+    assert len(report) == 0
+
+def test_nearest_row():
+    index = time_index(' 00:00:00.800', ' 00:00:01.800', ' 00:00:02.800')
+    assert nearest_row(index, ' 00:00:02.100')[TIME_GMT] == ' 00:00:01.800'
+    assert nearest_row(index, ' 23:00:00.000')[TIME_GMT] == ' 00:00:02.800'
+
+def test_nearest_row_invalid_time_or_empty_index():
+    index = time_index(' 00:00:00.800')
+    assert nearest_row(index, ' not a time') is None
+    assert nearest_row(index._replace(data=index.data.iloc[:0]), ' 00:00:00.800') is None
+
+def test_dslog_csv_round_trip_is_byte_exact(tmp_path):
+    file = tmp_path / 'AR221120_0000.csv'
+    file.write_bytes(DSLOG)
+    dslog = read_dslog_csv(str(file))
+    assert dslog.preamble == 'WHOI SSSG dsLogCsv V1.0 AR70b 1min'
+    assert dslog.newline == '\r\n'
+    assert dslog.data[' SBE45S'].tolist() == [' 32.100', ' 32.1000']
+    output = tmp_path / 'AR221120_0000_new.csv'
+    write_dslog_csv(str(output), dslog)
+    assert output.read_bytes() == DSLOG
+
+@pytest.mark.skipif(os.name == 'nt', reason='posix file modes')
+def test_replace_file_keeps_the_file_mode(tmp_path):
+    file = tmp_path / 'AR221120_0000.csv'
+    file.write_bytes(DSLOG)
+    os.chmod(file, 0o640)
+    write_dslog_csv(str(file), read_dslog_csv(str(file)))
+    assert stat.S_IMODE(os.stat(file).st_mode) == 0o640
+    assert file.read_bytes() == DSLOG
+
+def test_replace_file_leaves_the_file_on_error(tmp_path):
+    file = tmp_path / 'AR221120_0000.csv'
+    file.write_bytes(DSLOG)
+    with pytest.raises(ValueError):
+        with replace_file(str(file), newline='') as f:
+            f.write('partial')
+            raise ValueError('interrupted')
+    assert file.read_bytes() == DSLOG
+    assert os.listdir(tmp_path) == ['AR221120_0000.csv']
+
+def minutes(*times):
+    return pd.Series(pd.to_datetime([f"2022-11-20 {time}" for time in times], utc=True))
+
+def test_find_gaps_counts_missing_samples():
+    gaps, duplicates = find_gaps(minutes('14:50:00.8', '14:51:00.8', '14:55:00.8', '14:56:00.8'))
+    assert len(gaps) == 1
+    assert gaps['missing'].tolist() == [3]
+    assert gaps['start'].iloc[0] == pd.Timestamp('2022-11-20 14:51:00.8', tz='UTC')
+    assert gaps['end'].iloc[0] == pd.Timestamp('2022-11-20 14:55:00.8', tz='UTC')
+    assert not duplicates.any()
+
+def test_find_gaps_marks_duplicates_and_allows_jitter():
+    gaps, duplicates = find_gaps(minutes('00:00:00.8', '00:01:00.8', '00:01:00.8', '00:02:20.8'))
+    assert len(gaps) == 0
+    assert duplicates.tolist() == [False, False, True, False]
+
+def test_find_gaps_one_second_cadence():
+    times = pd.Series(pd.to_datetime(['2022-11-20 00:00:00', '2022-11-20 00:00:01', '2022-11-20 00:00:05'], utc=True))
+    gaps, _ = find_gaps(times, '1s')
+    assert gaps['missing'].tolist() == [3]
+
+def test_synthesize_rows_keeps_the_offset_and_nan_columns():
+    df = pd.DataFrame({DATE_GMT: ['2022/11/20', '2022/11/20'], TIME_GMT: [' 14:51:00.800', ' 14:54:00.800'],
+                       ' Dec_LAT': [' 41.0', ' 41.1'], ' SBE45S': [' 32.1', ' 32.2']})
+    times = dslog_times(df)
+    gaps, _ = find_gaps(times)
+    rows, new_times = synthesize_rows(df, times, gaps, nan_columns=['Dec_LAT'])
+    assert rows[TIME_GMT].tolist() == [' 14:52:00.800', ' 14:53:00.800']
+    assert rows[DATE_GMT].tolist() == ['2022/11/20', '2022/11/20']
+    assert rows[' Dec_LAT'].tolist() == [' NAN', ' NAN']
+    assert rows[' SBE45S'].tolist() == ['', '']
+    assert new_times.iloc[0] == pd.Timestamp('2022-11-20 14:52:00.8', tz='UTC')
+    assert synthesize_rows(df, times, gaps)[0][' SBE45S'].tolist() == [' NAN', ' NAN']
+
+def test_merge_par_nearest_within_tolerance():
+    df = pd.DataFrame({PAR_DATE: pd.to_datetime(['2023-04-29 03:30:00', '2023-04-29 03:31:00', None,
+                                                 '2023-04-29 03:40:00'], utc=True), 'value': [1, 2, 3, 4]})
+    pdf = pd.DataFrame({PAR_DATE: pd.to_datetime(['2023-04-29 03:29:50', '2023-04-29 03:30:40',
+                                                  '2023-04-29 03:31:05'], utc=True), 'par': [10.0, 20.0, 30.0]})
+    merged = merge_par(df, pdf, sensor='par', tolerance=30)
+    assert merged['value'].tolist() == [1, 2, 3, 4]
+    assert merged['par'].iloc[0] == 10.0
+    assert merged['par'].iloc[1] == 30.0
+    # no date, and no PAR record within 30 seconds
+    assert np.isnan(merged['par'].iloc[2])
+    assert np.isnan(merged['par'].iloc[3])
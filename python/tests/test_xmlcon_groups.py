@@ -0,0 +1,41 @@
+from xmlcon_groups import distinct_groups, get_cast, group_xmlcon_files, xmlcon_digests
+
+def xmlcon(serial_number, nmea='1', indent=''):
+    return (f'<SBE_InstrumentConfiguration>\n{indent}<Instrument>\n'
+            f'{indent}<NmeaPositionDataAdded>{nmea}</NmeaPositionDataAdded>\n'
+            f'{indent}<SensorArray><Sensor><TemperatureSensor><SerialNumber>{serial_number}</SerialNumber>'
+            f'</TemperatureSensor></Sensor></SensorArray>\n{indent}</Instrument>\n</SBE_InstrumentConfiguration>\n')
+
+def write_xmlcons(directory, configurations):
+    files = []
+    for name, text in configurations.items():
+        path = directory / name
+        path.write_text(text)
+        files.append(str(path))
+    return files
+
+def test_nmea_and_whitespace_do_not_change_the_digest(tmp_path):
+    first, nmea, indented, other = write_xmlcons(tmp_path, {
+        'a.xmlcon': xmlcon('4321'), 'b.xmlcon': xmlcon('4321', nmea='0'),
+        'c.xmlcon': xmlcon('4321', indent='    '), 'd.xmlcon': xmlcon('4322')})
+    digest, full_digest = xmlcon_digests(first)
+    assert xmlcon_digests(indented) == (digest, full_digest)
+    assert xmlcon_digests(nmea)[0] == digest and xmlcon_digests(nmea)[1] != full_digest
+    assert xmlcon_digests(other)[0] != digest
+
+def test_contiguous_groups(tmp_path):
+    files = write_xmlcons(tmp_path, {
+        'AR99_010.xmlcon': xmlcon('4321'), 'AR99_002.xmlcon': xmlcon('4321'), 'AR99_003.xmlcon': xmlcon('4321', nmea='0'),
+        'AR99_004.xmlcon': xmlcon('4322'), 'AR99_005.xmlcon': xmlcon('4322'), 'AR99_TEST.xmlcon': xmlcon('9999')})
+    groups = group_xmlcon_files(files)
+    # casts sorted numerically, the test cast is left out, 4321 is used again from cast 010
+    assert [(group.first_cast, group.last_cast) for group in groups] == [('002', '003'), ('004', '005'), ('010', '010')]
+    assert [get_cast(file) for file in groups[0].files] == ['002', '003']
+    assert [get_cast(file) for file in groups[0].nmea_files] == ['003']
+    assert groups[2].digest == groups[0].digest
+    assert distinct_groups(groups) == groups[:2]
+
+def test_only_test_casts(tmp_path):
+    files = write_xmlcons(tmp_path, {'AR61A_TEST.xmlcon': xmlcon('4321')})
+    groups = group_xmlcon_files(files)
+    assert len(groups) == 1 and groups[0].files == files
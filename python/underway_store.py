@@ -0,0 +1,133 @@
+# Ingest the daily Underway .csv processed files of a cruise into a columnar (Parquet) store partitioned by day.
+# The store holds typed numeric columns and a UTC datetime index, so that the fix scripts and QC code can
+# query a time range without re-parsing the text files:
+#     from underway_store import load_underway
+#     df = load_underway('AR61b_underway', start='2021-10-28 12:00', end='2021-10-28 18:00')
+# Layout: <store>/<dataset>/day=YYYY-MM-DD/part-0.parquet where dataset is 1min, gps or ssw (1 second files)
+# Times without a timezone are UTC. fix_gps_underway.py --store fills from the gps and ssw datasets through
+# load_time_index.
+
+import argparse
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from underway_utils import DATE_GMT, TIME_GMT, TIME_MS, FILE_ROW, MISSING_VALUES, TimeIndex, dslog_times
+
+DATE = 'date'
+DAY = 'day'
+
+# dsLogCsv file name patterns for each dataset
+DATASETS = {
+    '1min': re.compile(r'^[a-zA-Z]+\d+_\d{4}\.csv$'),
+    'gps': re.compile(r'.*GPS\d+_\d{6}_\d{4}\.csv$'),
+    'ssw': re.compile(r'.*SSW\d+_\d{6}_\d{4}\.csv$'),
+}
+
+def read_underway_file(file):
+    # Read a dsLogCsv file with a UTC date column, the other columns are stripped text and ' NAN' becomes missing
+    df = pd.read_csv(file, delimiter=',', header=1, dtype=str, keep_default_na=False)  # second row is header row
+    df.insert(0, DATE, dslog_times(df))
+    df = df.drop(columns=[DATE_GMT, TIME_GMT])
+    for column in df.columns[1:]:
+        text = df[column].str.strip()
+        df[column] = text.where(~text.str.upper().isin(MISSING_VALUES))
+    df.columns = [DATE] + [column.strip() for column in df.columns[1:]]   # note space in column header names
+    return df.dropna(subset=[DATE])
+
+def type_columns(df, float_dtype='float64'):
+    # Decide the type of each column once for the whole dataset, so every day partition has the same schema.
+    # A column is numeric when most of its values are numbers, other values (i.e. a corrupt 4x1.5) become NaN.
+    # Columns of text (i.e. NMEA strings) stay text, columns without any value are numeric
+    for column in df.columns[1:]:
+        text = df[column]
+        values = pd.to_numeric(text, errors='coerce')
+        if values.notna().sum() * 2 >= text.notna().sum():
+            invalid = text.notna().sum() - values.notna().sum()
+            if invalid:
+                print(f"Column {column}: {invalid} values that are not numbers are stored as NaN")
+            df[column] = values.astype(float_dtype)
+        else:
+            df[column] = text.astype(object)
+    return df
+
+def find_dataset_files(url, dataset):
+    pattern = DATASETS[dataset]
+    return sorted(entry.path for entry in os.scandir(url) if entry.is_file() and pattern.match(entry.name))
+
+def ingest(url, store, datasets=('1min',), float_dtype='float64'):
+    for dataset in datasets:
+        files = find_dataset_files(url, dataset)
+        if len(files) == 0:
+            print(f"There are no {dataset} files to ingest for this cruise.")
+            continue
+        print(f"Ingesting {len(files)} {dataset} files")
+        df = pd.concat([read_underway_file(file) for file in files], ignore_index=True)
+        df = type_columns(df.sort_values(DATE, kind='stable').reset_index(drop=True), float_dtype)
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+
+        dataset_dir = os.path.join(store, dataset)
+        if os.path.exists(dataset_dir):
+            shutil.rmtree(dataset_dir)
+        # one partition per UTC day, days from a file that crosses midnight go to the right partition
+        for day, day_df in df.groupby(df[DATE].dt.strftime('%Y-%m-%d')):
+            day_dir = os.path.join(dataset_dir, f"{DAY}={day}")
+            os.makedirs(day_dir, exist_ok=True)
+            day_df.to_parquet(os.path.join(day_dir, 'part-0.parquet'), index=False, schema=schema)
+        print(f"Wrote {len(df)} rows, {df[DATE].dt.date.nunique()} days to {dataset_dir}")
+
+def to_utc(time):
+    time = pd.Timestamp(time)
+    return time.tz_localize('UTC') if time.tzinfo is None else time.tz_convert('UTC')
+
+def load_underway(store, dataset='1min', start=None, end=None, columns=None):
+    # Load a time range from the store as a frame indexed by UTC date. Only the day partitions
+    # that overlap the range are read
+    filters = []
+    start = to_utc(start) if start is not None else None
+    end = to_utc(end) if end is not None else None
+    if start is not None:
+        filters.append((DAY, '>=', start.strftime('%Y-%m-%d')))
+    if end is not None:
+        filters.append((DAY, '<=', end.strftime('%Y-%m-%d')))
+    read_columns = None if columns is None else [DATE] + list(columns)
+    df = pd.read_parquet(os.path.join(store, dataset), columns=read_columns, filters=filters or None)
+    df = df.drop(columns=DAY, errors='ignore').set_index(DATE).sort_index()
+    if start is not None or end is not None:
+        df = df.loc[start:end]
+    return df
+
+def load_time_index(store, dataset, day, columns):
+    # The samples of one UTC day as a TimeIndex (see underway_utils.py) for fill_nearest_time, columns are the
+    # dsLogCsv column names (i.e. ' DPS112_LAT'). Values are the stored numbers as dsLogCsv text (' 41.0001',
+    # trailing zeros of the source file are not kept) and FILE_ROW is the position of the sample in the day
+    columns = list(columns)
+    start = to_utc(day).floor('D')
+    end = start + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+    df = load_underway(store, dataset, start, end, [column.strip() for column in columns])
+    data = pd.DataFrame({
+        TIME_MS: ((df.index - start) // pd.Timedelta(milliseconds=1)).to_numpy(dtype='int64'),
+        FILE_ROW: np.arange(len(df), dtype='int64'),
+        TIME_GMT: df.index.strftime(' %H:%M:%S.%f').str[:-3],
+    })
+    for column in columns:
+        data[column] = (' ' + df[column.strip()].astype(str)).to_numpy()
+    return TimeIndex(os.path.join(store, dataset, f"{DAY}={start:%Y-%m-%d}"), data, [])
+
+def main():
+    # If paths are on Google Docs, you must download the files to your local pc file system.
+    parser = argparse.ArgumentParser(description='Ingest daily Underway files (i.e. AR211028_0000.csv) into a Parquet store partitioned by day.')
+    parser.add_argument('path', type=str, help='Path to Underway files in the proc directory')
+    parser.add_argument('store', type=str, help='Output directory for the Parquet store')
+    parser.add_argument('--one-second', action='store_true', help='Also ingest the 1 second GPS and SSW files')
+    parser.add_argument('--float32', action='store_true', help='Store numeric columns as float32 instead of float64')
+
+    args = parser.parse_args()
+
+    datasets = ['1min', 'gps', 'ssw'] if args.one_second else ['1min']
+    ingest(args.path, args.store, datasets, 'float32' if args.float32 else 'float64')
+
+if __name__ == '__main__':
+    main()
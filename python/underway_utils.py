@@ -0,0 +1,270 @@
+# Shared helpers for the Underway fix scripts (fix_gps_underway.py, fix_ar70b_underway.py)
+# Reads and writes the SSSG dsLogCsv files (first line 'WHOI SSSG dsLogCsv ...', second line column headers).
+# Also reads the Light Logger (PAR) BSI*.csv files and attaches PAR to underway rows by nearest time.
+# Loads the 1 Hz GPS and Science SeaWater (SSW) sidecar files once into a sorted time index and
+# fills missing 1 minute values with a single nearest-time (as-of) merge.
+# Time indexes are cached as .npz files in a .underway_index directory next to the sidecar files.
+
+from collections import namedtuple
+from contextlib import contextmanager
+import hashlib
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+DATE_GMT = 'DATE_GMT'
+TIME_GMT = ' TIME_GMT'     # note space in column header name
+TIME_MS = 'TIME_MS'        # milliseconds since midnight GMT
+FILE_ROW = 'FILE_ROW'      # row offset of a sample in its source file
+INDEX_DIR = '.underway_index'
+MISSING_VALUES = {'', 'NAN', 'NA'}
+PAR_DATE = 'date'
+PAR_SENSOR = 'QSR - S/N 10367'
+
+# preamble: the 'WHOI SSSG dsLogCsv' first line, newline: line ending of the source file, data: all columns as text
+DsLogCsv = namedtuple('DsLogCsv', ['preamble', 'newline', 'data'])
+
+# data: TIME_MS plus the requested columns sorted by time, invalid_times: unparseable TIME_GMT strings
+TimeIndex = namedtuple('TimeIndex', ['file', 'data', 'invalid_times'])
+
+def time_gmt_to_ms(series):
+    # Parse ' HH:MM:SS.fff' strings into milliseconds since midnight, invalid entries become NaN
+    times = pd.to_datetime(series.astype(str).str.strip(), format='%H:%M:%S.%f', errors='coerce')
+    return (times.dt.hour * 3600000 + times.dt.minute * 60000 +
+            times.dt.second * 1000 + times.dt.microsecond // 1000)
+
+def is_missing(series):
+    # True for NaN and for the ' NAN' / empty string sentinels used in the SSSG csv files
+    text = series.astype(str).str.strip().str.upper()
+    return series.isna() | text.isin(MISSING_VALUES)
+
+def read_dslog_csv(file):
+    # Read a dsLogCsv file in one pass. The first line ('WHOI SSSG dsLogCsv' does not conform to df with columns)
+    # is kept as metadata and every cell is read as text so that untouched cells are written back unchanged
+    with open(file, 'r', newline='') as f:
+        first_line = f.readline()
+        preamble = first_line.rstrip('\r\n')
+        newline = first_line[len(preamble):] or '\n'
+        data = pd.read_csv(f, delimiter=',', dtype=str, keep_default_na=False)
+    return DsLogCsv(preamble, newline, data)
+
+def file_mode(file):
+    # permissions of an existing file, else the default permissions of a new file (mkstemp creates 0600 files)
+    try:
+        return os.stat(file).st_mode & 0o777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+@contextmanager
+def replace_file(file, **open_args):
+    # Open a temporary file in the directory of file for writing, it is renamed over file (keeping the
+    # permissions of file) when the block ends, so that a crash cannot leave a half-written file
+    directory = os.path.dirname(os.path.abspath(file))
+    mode = file_mode(file)
+    fd, temp_file = tempfile.mkstemp(prefix='.' + os.path.basename(file), suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', **open_args) as f:
+            yield f
+        os.chmod(temp_file, mode)
+        os.replace(temp_file, file)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+def write_dslog_csv(file, dslog):
+    # Write the preamble line and the frame in one pass, replacing the file
+    with replace_file(file, newline='') as f:
+        f.write(dslog.preamble + dslog.newline)
+        dslog.data.to_csv(f, index=False, lineterminator=dslog.newline)
+
+def dslog_times(df):
+    # Combine the DATE_GMT and TIME_GMT text columns into UTC timestamps, invalid entries become NaT
+    text = df[DATE_GMT].astype(str).str.strip() + ' ' + df[TIME_GMT].astype(str).str.strip()
+    return pd.to_datetime(text, format='%Y/%m/%d %H:%M:%S.%f', errors='coerce', utc=True)
+
+def find_gaps(times, cadence='1min'):
+    # Find gaps and duplicates in a sorted series of timestamps with a regular cadence.
+    # Returns a frame with one row per gap (start, end and number of missing samples) and a boolean
+    # mask of samples that repeat the previous timestamp
+    step = pd.Timedelta(cadence)
+    diff = times.diff()
+    duplicates = (diff == pd.Timedelta(0)).to_numpy()
+    is_gap = (diff > step * 1.5).to_numpy()    # allow for jitter in the logged times
+    gaps = pd.DataFrame({
+        'start': times.shift(1)[is_gap].to_numpy(),
+        'end': times[is_gap].to_numpy(),
+        'missing': (diff[is_gap] / step).round().astype('int64').to_numpy() - 1,
+    })
+    return gaps, duplicates
+
+def synthesize_rows(df, times, gaps, cadence='1min', fill_value=' NAN', nan_columns=None):
+    # Create the missing rows for all gaps at once: each gap is filled at the cadence of the sample
+    # before it (so the :00.800 offset of the 1 minute files is kept). Returns the new rows and their times.
+    # nan_columns: column names (without the leading space) that get fill_value, other cells are left empty
+    # (default: fill_value in every column)
+    step = pd.Timedelta(cadence)
+    counts = gaps['missing'].to_numpy()
+    starts = np.repeat(gaps['start'].to_numpy(), counts)
+    # position of each new row within its gap, 1..missing
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    new_times = pd.DatetimeIndex(starts, tz='UTC') + step * offsets
+
+    # keep the leading space the SSSG files use in front of values
+    date_prefix = ' ' if df[DATE_GMT].astype(str).str.startswith(' ').any() else ''
+    time_prefix = ' ' if df[TIME_GMT].astype(str).str.startswith(' ').any() else ''
+    rows = pd.DataFrame(fill_value, index=range(len(new_times)), columns=df.columns)
+    if nan_columns is not None:
+        rows[[column for column in df.columns if column.strip() not in nan_columns]] = ''
+    rows[DATE_GMT] = date_prefix + new_times.strftime('%Y/%m/%d')
+    rows[TIME_GMT] = time_prefix + pd.Series(new_times.strftime('%H:%M:%S.%f')).str[:-3]
+    return rows, pd.Series(new_times)
+
+def read_time_index(file, columns):
+    # read the TIME_GMT column and the requested columns once, values are kept as text so that
+    # filled cells are written exactly as they appear in the source file
+    columns = list(columns)
+    df = pd.read_csv(file, delimiter=',', header=1, usecols=[TIME_GMT] + columns,   # second row is header row
+                     dtype=str, keep_default_na=False)
+    ms = time_gmt_to_ms(df[TIME_GMT])
+    invalid_times = list(df.loc[ms.isna(), TIME_GMT].unique())
+
+    df = df.loc[ms.notna()].copy()
+    df.insert(0, TIME_MS, ms[ms.notna()].astype('int64'))
+    df.insert(1, FILE_ROW, df.index.astype('int64'))    # row offset of the sample in the source file
+    df = df.sort_values(TIME_MS, kind='stable').reset_index(drop=True)
+    return TimeIndex(file, df, invalid_times)
+
+def index_cache_path(file, columns):
+    # one cache file per sidecar file and column selection, stored next to the cruise files
+    key = hashlib.sha1('|'.join(columns).encode()).hexdigest()[:8]
+    return os.path.join(os.path.dirname(os.path.abspath(file)), INDEX_DIR, f"{os.path.basename(file)}.{key}.npz")
+
+def load_time_index(file, columns, cache=True):
+    # Return the time index for a GPS/SSW file, reusing the cached .npz index when the file path,
+    # size and modification time are unchanged since it was built
+    columns = list(columns)
+    if not cache:
+        return read_time_index(file, columns)
+
+    path = os.path.abspath(file)
+    stat = os.stat(path)
+    cache_file = index_cache_path(path, columns)
+    try:
+        with np.load(cache_file) as npz:
+            if (str(npz['path']) == path and int(npz['size']) == stat.st_size and
+                    int(npz['mtime_ns']) == stat.st_mtime_ns and list(npz['columns']) == columns):
+                data = {TIME_MS: npz[TIME_MS], FILE_ROW: npz[FILE_ROW], TIME_GMT: npz['time_gmt'].astype(object)}
+                for i, column in enumerate(columns):
+                    data[column] = npz[f'column_{i}'].astype(object)
+                return TimeIndex(file, pd.DataFrame(data), list(npz['invalid_times']))
+    except (OSError, KeyError, ValueError):
+        pass    # missing or unreadable cache, rebuild below
+
+    index = read_time_index(file, columns)
+    arrays = {
+        'path': np.array(path),
+        'size': np.array(stat.st_size),
+        'mtime_ns': np.array(stat.st_mtime_ns),
+        'columns': np.array(columns, dtype=str),
+        'invalid_times': np.array(index.invalid_times, dtype=str),
+        TIME_MS: index.data[TIME_MS].to_numpy(),
+        FILE_ROW: index.data[FILE_ROW].to_numpy(),
+        'time_gmt': index.data[TIME_GMT].to_numpy(dtype=str),
+    }
+    for i, column in enumerate(columns):
+        arrays[f'column_{i}'] = index.data[column].to_numpy(dtype=str)
+    try:
+        # write to a temporary file first so that an interrupted run never leaves a partial cache
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_file = cache_file + '.tmp'
+        with open(temp_file, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        print(f"Could not write time index cache {cache_file}: {e}")
+    return index
+
+def nearest_row(index, time_gmt):
+    # Return the sample in the time index nearest to a single ' HH:MM:SS.fff' time, None when the time is
+    # invalid or the index has no samples
+    target = time_gmt_to_ms(pd.Series([time_gmt])).iloc[0]
+    times = index.data[TIME_MS].to_numpy()
+    if pd.isna(target) or len(times) == 0:
+        return None
+    position = int(np.searchsorted(times, target))
+    candidates = [p for p in (position - 1, position) if 0 <= p < len(times)]
+    best = min(candidates, key=lambda p: abs(times[p] - target))
+    return index.data.iloc[best]
+
+def fill_nearest_time(df, index, column_map, rows, tolerance=None):
+    # Fill df[target] from the nearest-in-time sample of index[source] for every row in the boolean mask rows.
+    # column_map maps target column -> source column, tolerance is the maximum offset in seconds (None = any).
+    # df is modified in place. Returns a report with one line per filled cell and the rows that could not be filled.
+    left = pd.DataFrame({'ROW': df.index[rows], TIME_GMT: df.loc[rows, TIME_GMT]})
+    left[TIME_MS] = time_gmt_to_ms(left[TIME_GMT])
+    unmatched = list(left.loc[left[TIME_MS].isna(), 'ROW'])
+    left = left.dropna(subset=[TIME_MS])
+    left[TIME_MS] = left[TIME_MS].astype('int64')
+    left = left.sort_values(TIME_MS, kind='stable')
+
+    right = index.data.rename(columns={TIME_GMT: 'SOURCE_TIME_GMT', FILE_ROW: 'SOURCE_ROW'})
+    right['SOURCE_MS'] = right[TIME_MS]
+    right = right.drop(columns=TIME_MS)
+
+    merged = pd.merge_asof(left, right, left_on=TIME_MS, right_on='SOURCE_MS', direction='nearest',
+                           tolerance=None if tolerance is None else int(tolerance * 1000))
+    unmatched += list(merged.loc[merged['SOURCE_MS'].isna(), 'ROW'])
+    merged = merged.dropna(subset=['SOURCE_MS'])
+
+    reports = []
+    for target, source in column_map.items():
+        found = merged.loc[~is_missing(merged[source])]
+        values = found[source]
+        if pd.api.types.is_numeric_dtype(df[target]):
+            values = pd.to_numeric(values, errors='coerce')
+        df.loc[found['ROW'].to_numpy(), target] = values.to_numpy()
+
+        reports.append(pd.DataFrame({
+            'ROW': found['ROW'],
+            TIME_GMT: found[TIME_GMT],
+            'COLUMN': target,
+            'SOURCE_FILE': index.file,
+            'SOURCE_ROW': found['SOURCE_ROW'],
+            'SOURCE_TIME_GMT': found['SOURCE_TIME_GMT'],
+            'OFFSET_SECONDS': (found['SOURCE_MS'] - found[TIME_MS]) / 1000,
+        }))
+        missing = merged.loc[is_missing(merged[source])]
+        if len(missing) > 0:
+            print(f"ERROR: {len(missing)} nearest {source.strip()} values in {index.file} are NAN. Cannot fix Underway file at those times.")
+
+    report = pd.concat(reports, ignore_index=True).sort_values(['ROW', 'COLUMN'], kind='stable')
+    return report.reset_index(drop=True), sorted(set(unmatched))
+
+def read_par_files(files, sensor=PAR_SENSOR, skiprows=8, time_format=None):
+    # Read only the Time and sensor columns of the Light Logger files and concatenate them in time order.
+    # Malformed times become NaT and are dropped
+    pfs = []
+    for file in sorted(files):
+        pfs.append(pd.read_csv(file, delimiter=',', skiprows=skiprows, encoding='cp1252', usecols=['Time', sensor]))
+    pdf = pd.concat(pfs, ignore_index=True)
+    pdf.insert(0, PAR_DATE, pd.to_datetime(pdf['Time'], format=time_format, errors='coerce', utc=True))
+    invalid = pdf[PAR_DATE].isna().sum()
+    if invalid > 0:
+        print(f"Dropping {invalid} PAR records with invalid Time")
+    return pdf.dropna(subset=[PAR_DATE]).sort_values(PAR_DATE, kind='stable').reset_index(drop=True)
+
+def merge_par(df, pdf, sensor=PAR_SENSOR, tolerance=30):
+    # Add the sensor column of pdf to df from the nearest PAR record within tolerance seconds of each
+    # row's date, rows without a PAR record that close get NaN. Prints the match rate
+    left = pd.DataFrame({PAR_DATE: df[PAR_DATE].to_numpy(), 'ROW': np.arange(len(df))})
+    valid = left[PAR_DATE].notna()
+    merged = pd.merge_asof(left[valid].sort_values(PAR_DATE, kind='stable'), pdf[[PAR_DATE, sensor]],
+                           on=PAR_DATE, direction='nearest', tolerance=pd.Timedelta(seconds=tolerance))
+    result = df.copy()
+    result[sensor] = merged.set_index('ROW')[sensor].reindex(range(len(df))).to_numpy()
+    matched = result[sensor].notna().sum()
+    print(f"Matched {sensor} for {matched} of {len(df)} rows ({100 * matched / max(len(df), 1):.1f}%) within {tolerance} seconds")
+    return result
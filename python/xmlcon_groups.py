@@ -0,0 +1,81 @@
+# Group the XMLCON files of a cruise by configuration without comparing every file with xmldiff.
+# Each file is canonicalized (C14N 2.0, text whitespace stripped, Nmea* settings removed) and hashed.
+# Casts with the same hash in a row form a group (a contiguous cast range), so only one file per
+# distinct configuration needs to be diffed and checked against the calibration files.
+# Test casts (i.e. AR61A_TEST.xmlcon) are not part of a cast range.
+
+from collections import namedtuple
+import hashlib
+import os
+import xml.etree.ElementTree as ET
+from xmldiff import main as xmldiff_main, formatting
+
+# digest: hash of the canonical XMLCON without the Nmea settings, files: in cast order,
+# nmea_files: files of the group whose Nmea settings differ from the first file
+XmlconGroup = namedtuple('XmlconGroup', ['digest', 'first_cast', 'last_cast', 'files', 'nmea_files'])
+
+def get_cast(file):
+    # cast number text from the file name, i.e. AR99_001.xmlcon, AR34A001.xmlcon, EN617_CAST01_L1.xmlcon
+    base_filename = os.path.basename(file)
+    parts = base_filename.split('_')
+    try:
+        cast = parts[1].split('.')[0]
+    except IndexError:
+        cast = base_filename.split('.')[0][-3:]  #AR34A001.xmlcon
+    return cast.lstrip("CAST")  #EN617_CAST01_L1.xmlcon
+
+def is_test_file(file):
+    return '_TEST' in file   #AR61A
+
+def cast_order(file):
+    cast = get_cast(file)
+    return (0, int(cast), file) if cast.isdigit() else (1, 0, file)
+
+def canonical_xmlcon(root):
+    return ET.canonicalize(ET.tostring(root, encoding='unicode'), strip_text=True)
+
+def remove_nmea_settings(root):
+    # NMEA settings change between casts without any sensor change (AR61a, AR61b, AR78)
+    for parent in root.iter():
+        for child in list(parent):
+            if child.tag.lower().startswith('nmea'):
+                parent.remove(child)
+
+def xmlcon_digests(file):
+    # (digest without the Nmea settings, digest of the whole file), the file is parsed once
+    with open(file, 'rb') as f:
+        root = ET.fromstring(f.read())
+    full_digest = hashlib.sha256(canonical_xmlcon(root).encode()).hexdigest()
+    remove_nmea_settings(root)
+    return hashlib.sha256(canonical_xmlcon(root).encode()).hexdigest(), full_digest
+
+def group_xmlcon_files(files):
+    # Return the groups of contiguous casts with the same configuration, in cast order, test casts are left out
+    # unless there are only test casts
+    groups = []
+    previous_full_digest = None
+    cast_files = [file for file in files if not is_test_file(file)] or files
+    for file in sorted(cast_files, key=cast_order):
+        digest, full_digest = xmlcon_digests(file)
+        cast = get_cast(file)
+        if groups and groups[-1].digest == digest:
+            group = groups[-1]
+            if full_digest != previous_full_digest:
+                group.nmea_files.append(file)
+            group.files.append(file)
+            groups[-1] = group._replace(last_cast=cast)
+        else:
+            groups.append(XmlconGroup(digest, cast, cast, [file], []))
+            previous_full_digest = full_digest
+    return groups
+
+def distinct_groups(groups):
+    # first group of each configuration, a configuration can be used again in a later cast range
+    first_groups = {}
+    for group in groups:
+        first_groups.setdefault(group.digest, group)
+    return list(first_groups.values())
+
+def diff_xmlcon_files(observed, expected):
+    formatter = formatting.DiffFormatter()
+    return xmldiff_main.diff_files(observed, expected, formatter=formatter)